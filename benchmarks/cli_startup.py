@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import time
+
+from benchmarks.stub_server import StubHandler, start_stub_server, write_stub_config
+from cli.cli import StudioCli
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paths", type=int, default=300)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    schema = json.dumps(build_schema(args.paths)).encode()
+
+    class SchemaHandler(StubHandler):
+        def do_GET(self):
+            if self.path.split("?")[0].endswith("/apidocs"):
+                self._send(200, schema)
+            else:
+                super().do_GET()
+
+    server = start_stub_server(SchemaHandler)
+    config_path = write_stub_config(server)
+    try:
+        studio_cli = StudioCli(config_path, refresh_schema=True)
+        command_name = next(iter(studio_cli.command_index))
+
+        def full_command_table():
+            subparsers = argparse.ArgumentParser().add_subparsers()
+            for name in studio_cli._build_command_index(studio_cli.schema):
+                studio_cli._extend_subparsers(studio_cli.get_command(name), subparsers)
+
+        def cold_start():
+            StudioCli(config_path, refresh_schema=True).build_commands(
+                argparse.ArgumentParser().add_subparsers(), command_name
+            )
+
+        def warm_start():
+            StudioCli(config_path).build_commands(
+                argparse.ArgumentParser().add_subparsers(), command_name
+            )
+
+        print(f"{len(studio_cli.command_index)} commands, {len(schema)} bytes schema")
+        report("all commands and subparsers", args.runs, full_command_table)
+        report("cold start (schema download)", args.runs, cold_start)
+        report("warm start (cached schema)", args.runs, warm_start)
+        os.remove(studio_cli.schema_cache.path)
+    finally:
+        server.shutdown()
+        os.remove(config_path)
+
+
+def build_schema(path_count):
+    parameters = [
+        {"name": f"param_{i}", "in": "query", "type": "string", "description": "x"}
+        for i in range(5)
+    ]
+    paths = {}
+    for i in range(path_count):
+        paths[f"/resource_{i}s/{{resource_{i}_id}}"] = {
+            method: {
+                "summary": f"{method} resource {i}",
+                "parameters": parameters
+                + [
+                    {
+                        "name": f"resource_{i}_id",
+                        "in": "path",
+                        "type": "integer",
+                        "required": True,
+                        "description": "id",
+                    }
+                ],
+                "responses": {
+                    "200": {"schema": {"properties": {"a": {"type": "object"}}}}
+                },
+            }
+            for method in ["get", "put", "delete"]
+        }
+    return {"paths": paths}
+
+
+def report(name, runs, call):
+    start = time.perf_counter()
+    for _ in range(runs):
+        call()
+    elapsed = (time.perf_counter() - start) / runs
+    print(f"{name:30} {elapsed * 1000:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
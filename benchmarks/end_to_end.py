@@ -0,0 +1,224 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.mock_studio import MockStudio, start_mock_studio
+from benchmarks.stub_server import write_stub_config
+
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs the command as its own child and prints the exit code, wall time and
+# peak memory of the command. The peak memory of a child starts at that of
+# the process it was forked from, which for the benchmark includes the mock
+# Studio API, so the command is forked from this small process instead.
+LAUNCHER = """
+import os, sys, time
+start = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    try:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        os.execv(sys.argv[1], sys.argv[1:])
+    finally:
+        os._exit(127)
+_, status, rusage = os.wait4(pid, 0)
+elapsed = time.perf_counter() - start
+print(os.waitstatus_to_exitcode(status), elapsed, rusage.ru_maxrss)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs the CLI and the examples against the mock Studio API"
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="run only these scenarios (can be given multiple times)",
+    )
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--perspectives", type=int, default=10)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--media", type=int, default=200)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--upload-size", type=int, default=1024 * 1024)
+    parser.add_argument("--download-size", type=int, default=10 * 1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limited-rate", type=float, default=0.0)
+    parser.add_argument("--upload-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    studio = MockStudio(
+        courses=args.courses,
+        perspectives=args.perspectives,
+        users=args.users,
+        media=args.media,
+        download_size=args.download_size,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        unauthorized_rate=args.unauthorized_rate,
+        rate_limited_rate=args.rate_limited_rate,
+        upload_error_rate=args.upload_error_rate,
+        seed=0,
+    )
+    server = start_mock_studio(studio)
+    work_dir = tempfile.mkdtemp(prefix="studio-benchmark-")
+    try:
+        scenarios = build_scenarios(args, work_dir)
+        print(
+            f"{'scenario':22} {'items':>7} {'p50 [s]':>9} {'p95 [s]':>9} "
+            f"{'items/s':>9} {'requests/s':>11} {'peak RSS [MB]':>14} {'failed':>7}"
+        )
+        for name, argv, items in scenarios:
+            if args.scenario and name not in args.scenario:
+                continue
+            results = []
+            for _ in range(args.runs):
+                config_path = write_stub_config(server)
+                requests_before = studio.stats["requests"]
+                elapsed, max_rss, exit_code = run(
+                    [sys.executable]
+                    + [arg.replace("{config}", config_path) for arg in argv],
+                    work_dir,
+                )
+                results.append(
+                    (
+                        elapsed,
+                        max_rss,
+                        exit_code,
+                        studio.stats["requests"] - requests_before,
+                    )
+                )
+                os.remove(config_path)
+            report(name, items, results)
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir)
+
+
+def build_scenarios(args, work_dir):
+    """
+    Returns `(name, argv, items)` of the scenarios, `{config}` in the
+    arguments is replaced with the config file of the run.
+    """
+    cli = os.path.join(REPOSITORY_DIR, "cli", "cli.py")
+
+    def example(name):
+        return os.path.join(REPOSITORY_DIR, "examples", name, "main.py")
+
+    media_ids_file = os.path.join(work_dir, "media_ids.txt")
+    with open(media_ids_file, "w") as f:
+        f.writelines(f"{media_id}\n" for media_id in range(1, args.media + 1))
+
+    upload_files = []
+    for i in range(args.uploads):
+        upload_files.append(os.path.join(work_dir, f"upload-{i}.mp4"))
+        with open(upload_files[-1], "wb") as f:
+            f.write(os.urandom(args.upload_size))
+
+    course_ids = [str(course_id) for course_id in range(1, args.courses + 1)]
+    return [
+        ("cli ping", [cli, "--config", "{config}", "ping"], 1),
+        (
+            "cli show_media",
+            [cli, "--config", "{config}", "show_media", "--media_id", "1"],
+            1,
+        ),
+        (
+            "cli list courses",
+            [
+                cli,
+                "--config",
+                "{config}",
+                "show_courses",
+                "--all-pages",
+                "--per_page",
+                "5",
+            ],
+            args.courses,
+        ),
+        (
+            "cli download",
+            [
+                cli,
+                "--config",
+                "{config}",
+                "download_media",
+                "--media_id",
+                "1",
+                "--output",
+                os.path.join(work_dir, "download.mp4"),
+            ],
+            1,
+        ),
+        ("test", [example("test"), "--config", "{config}"], 1),
+        (
+            "insights",
+            [example("get-insights-data"), "--config", "{config}"] + course_ids,
+            args.courses * args.perspectives,
+        ),
+        (
+            "media details",
+            [
+                example("get-media-details"),
+                "--config",
+                "{config}",
+                "--batch",
+                media_ids_file,
+            ],
+            args.media,
+        ),
+        (
+            "upload",
+            [example("upload-media-from-local"), "--config", "{config}"] + upload_files,
+            args.uploads,
+        ),
+    ]
+
+
+def run(argv, work_dir):
+    """
+    Runs the command through `LAUNCHER`, returns its wall time, peak memory
+    in bytes and exit code.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", LAUNCHER] + argv,
+        cwd=work_dir,
+        env=dict(os.environ, PYTHONPATH=REPOSITORY_DIR),
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stdout
+    exit_code, elapsed, max_rss = output.split()
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = int(max_rss) * (1 if sys.platform == "darwin" else 1024)
+    return float(elapsed), max_rss, int(exit_code)
+
+
+def report(name, items, results):
+    times = sorted(elapsed for elapsed, _, _, _ in results)
+    p50 = statistics.median(times)
+    p95 = times[min(len(times) - 1, round(0.95 * (len(times) - 1)))]
+    requests = sum(count for _, _, _, count in results)
+    failed = sum(1 for _, _, exit_code, _ in results if exit_code != 0)
+    peak_rss = max(max_rss for _, max_rss, _, _ in results)
+    print(
+        f"{name:22} {items:7} {p50:9.3f} {p95:9.3f} {items / p50:9.1f} "
+        f"{requests / sum(times):11.1f} {peak_rss / 1024 / 1024:14.1f} {failed:7}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,542 @@
+import argparse
+import calendar
+import collections
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+from benchmarks.stub_server import StubHandler, start_stub_server, write_stub_config
+
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class MockStudio:
+    """
+    The data and the fault injection settings of the mock Studio API.
+
+    Every request is delayed by `latency` plus a random `jitter`, and API
+    requests fail with the given rates: `error_rate` with a 500,
+    `unauthorized_rate` with a 401 (the client has to refresh its token) and
+    `rate_limited_rate` with a 429 and a `Retry-After` of `retry_after`
+    seconds. `stats` counts the requests by route and status.
+
+    Presigned upload URLs are signed like S3 ones and expire after
+    `upload_url_ttl` seconds. PUTs to them fail with a 500 after the body is
+    read at `upload_error_rate`.
+    """
+
+    def __init__(
+        self,
+        courses=20,
+        perspectives=10,
+        users=100,
+        media=1000,
+        download_size=10 * 1024 * 1024,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        unauthorized_rate=0.0,
+        rate_limited_rate=0.0,
+        retry_after=0,
+        upload_url_ttl=3600,
+        upload_error_rate=0.0,
+        seed=None,
+    ):
+        self.courses = courses
+        self.perspectives = perspectives
+        self.users = users
+        self.media = media
+        self.download_body = (bytes(range(256)) * (download_size // 256 + 1))[
+            :download_size
+        ]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.unauthorized_rate = unauthorized_rate
+        self.rate_limited_rate = rate_limited_rate
+        self.retry_after = retry_after
+        self.upload_url_ttl = upload_url_ttl
+        self.upload_error_rate = upload_error_rate
+        self.random = random.Random(seed)
+        self.stats = collections.Counter()
+        self.uploads = {}
+        self.upload_ids = itertools.count(1)
+        self.token_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def fault(self):
+        """
+        Returns the status code of the fault to inject, or None.
+        """
+        with self.lock:
+            roll = self.random.random()
+        for status, rate in [
+            (500, self.error_rate),
+            (401, self.unauthorized_rate),
+            (429, self.rate_limited_rate),
+        ]:
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    def upload_fault(self):
+        with self.lock:
+            return self.random.random() < self.upload_error_rate
+
+    def delay(self):
+        with self.lock:
+            jitter = self.random.uniform(0, self.jitter)
+        time.sleep(self.latency + jitter)
+
+    def record(self, route, status):
+        with self.lock:
+            self.stats[f"{route} {status}"] += 1
+            self.stats["requests"] += 1
+
+
+class MockStudioHandler(StubHandler):
+    # method, path pattern (without /api/public/ and the version), handler,
+    # whether it's an API route which needs a token and gets faults injected
+    routes = [
+        ("POST", r"oauth/token", "_oauth_token", False),
+        ("GET", r"ping", "_ping", True),
+        ("GET", r"apidocs", "_apidocs", True),
+        ("GET", r"courses", "_courses", True),
+        ("GET", r"courses/(\d+)", "_course", True),
+        ("GET", r"courses/(\d+)/perspectives", "_perspectives", True),
+        (
+            "GET",
+            r"perspectives/([0-9a-f-]+)/insights/(overview|users)",
+            "_insights",
+            True,
+        ),
+        ("GET", r"media/(\d+)", "_media", True),
+        (
+            "GET",
+            r"media/(\d+)/(caption_files|courses|tags|users)",
+            "_media_detail",
+            True,
+        ),
+        ("GET", r"media/(\d+)/download", "_download", True),
+        ("POST", r"media/uploads", "_create_upload", True),
+        ("POST", r"media/uploads/(\d+)/complete", "_complete_upload", True),
+        ("PUT", r"presigned/(\d+)", "_presigned_put", False),
+        ("GET", r"files/(\d+)", "_file", False),
+    ]
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    @property
+    def studio(self):
+        return self.server.studio
+
+    def _handle(self, method):
+        path, _, query = self.path.partition("?")
+        self.params = {
+            name: values[0] for name, values in urllib.parse.parse_qs(query).items()
+        }
+        path = re.sub("/+", "/", path).strip("/")
+        path = re.sub(r"^api/public/(v\d+/)?", "", path)
+
+        self.studio.delay()
+        for route_method, pattern, handler, api in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method != method or not match:
+                continue
+            self.route = pattern
+            if api:
+                fault = self.studio.fault()
+                if fault or not self._authorized():
+                    self._read_body()
+                    return self._send_fault(fault or 401)
+            return getattr(self, handler)(*match.groups())
+
+        self.route = "unknown"
+        self._read_body()
+        self._send_json(404, {"error": "not found"})
+
+    def _authorized(self):
+        authorization = self.headers.get("Authorization", "")
+        return authorization.startswith("Bearer access-token")
+
+    def _send_fault(self, status):
+        if status == 429:
+            self.send_response(429)
+            self.send_header("Retry-After", str(self.studio.retry_after))
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            body = json.dumps({"error": "rate limited"}).encode()
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            self.studio.record(self.route, 429)
+            return
+        errors = {401: "unauthorized", 500: "internal server error"}
+        self._send_json(status, {"error": errors[status]})
+
+    def _send(self, status, body, content_type="application/json; charset=utf-8"):
+        super()._send(status, body, content_type)
+        self.studio.record(self.route, status)
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data).encode())
+
+    def _read_body(self):
+        """
+        Reads and discards the request body, returns its size.
+        """
+        size = 0
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                chunk_size = int(self.rfile.readline().split(b";")[0], 16)
+                if chunk_size == 0:
+                    self.rfile.readline()
+                    return size
+                size += len(self.rfile.read(chunk_size))
+                self.rfile.readline()
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining:
+            chunk = self.rfile.read(min(remaining, DOWNLOAD_CHUNK_SIZE))
+            if not chunk:
+                break
+            size += len(chunk)
+            remaining -= len(chunk)
+        return size
+
+    def _oauth_token(self):
+        self._read_body()
+        token_id = next(self.studio.token_ids)
+        self._send_json(
+            200,
+            {
+                "access_token": f"access-token-{token_id}",
+                "refresh_token": f"refresh-token-{token_id}",
+                "expires_in": 7200,
+            },
+        )
+
+    def _ping(self):
+        self._send(200, b"pong", "text/plain")
+
+    def _apidocs(self):
+        body = json.dumps(build_schema()).encode()
+        self._send_cacheable(body, "application/json; charset=utf-8")
+
+    def _send_cacheable(self, body, content_type):
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            self.studio.record(self.route, 304)
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.studio.record(self.route, 200)
+
+    def _courses(self):
+        page = int(self.params.get("page", 1))
+        per_page = int(self.params.get("per_page", 50))
+        first = (page - 1) * per_page + 1
+        ids = range(first, min(first + per_page, self.studio.courses + 1))
+        self._send_json(
+            200,
+            {
+                "courses": [self._course_data(course_id) for course_id in ids],
+                "meta": {
+                    "current_page": page,
+                    "last_page": max(1, -(-self.studio.courses // per_page)),
+                },
+            },
+        )
+
+    def _course_data(self, course_id):
+        return {"id": course_id, "course_id": course_id, "name": f"Course {course_id}"}
+
+    def _course(self, course_id):
+        if not 1 <= int(course_id) <= self.studio.courses:
+            return self._send_json(404, {"error": "course not found"})
+        self._send_json(200, {"course": self._course_data(int(course_id))})
+
+    def _perspectives(self, course_id):
+        if not 1 <= int(course_id) <= self.studio.courses:
+            return self._send_json(404, {"error": "course not found"})
+        self._send_json(
+            200,
+            {
+                "perspectives": [
+                    {
+                        "uuid": str(uuid.UUID(int=int(course_id) << 32 | i)),
+                        "title": f"Video {i}",
+                    }
+                    for i in range(self.studio.perspectives)
+                ]
+            },
+        )
+
+    def _insights(self, perspective_uuid, kind):
+        seed = int(hashlib.sha256(perspective_uuid.encode()).hexdigest()[:8], 16)
+        if kind == "overview":
+            body = (
+                "Metric,Value\n"
+                f"Views,{seed % 500}\n"
+                f"Time Viewed [min],{seed % 5000 / 10}\n"
+                f"Unique Viewers,{seed % 100}\n"
+            )
+        else:
+            body = "Name,Email,Role,Completion rate [%]\n" + "".join(
+                f"User {i},user{i}@example.com,student,{(seed + i) % 101}\n"
+                for i in range(self.studio.users)
+            )
+        self._send_cacheable(body.encode(), "text/csv")
+
+    def _media_data(self, media_id):
+        return {
+            "id": media_id,
+            "title": f"Media {media_id}",
+            "description": "",
+            "duration": 60.0,
+            "size": len(self.studio.download_body),
+            "created_at": "2023-01-01T00:00:00Z",
+            "owner": {"id": 1, "name": "Owner"},
+            "collection": {"id": 1, "name": "Collection"},
+        }
+
+    def _media(self, media_id):
+        if not 1 <= int(media_id) <= self.studio.media:
+            return self._send_json(404, {"error": "media not found"})
+        self._send_json(200, {"media": self._media_data(int(media_id))})
+
+    def _media_detail(self, media_id, detail):
+        if not 1 <= int(media_id) <= self.studio.media:
+            return self._send_json(404, {"error": "media not found"})
+        key = "user_permissions" if detail == "users" else detail
+        self._send_json(200, {key: [{"id": i} for i in range(3)]})
+
+    def _download(self, media_id):
+        if not 1 <= int(media_id) <= self.studio.media:
+            return self._send_json(404, {"error": "media not found"})
+        # like Studio, the file itself is downloaded from the storage
+        self.send_response(302)
+        self.send_header("Location", f"/files/{media_id}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.studio.record(self.route, 302)
+
+    def _file(self, media_id):
+        body = self.studio.download_body
+        start = 0
+        range_header = self.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            start = int(range_header[len("bytes=") :].split("-")[0])
+            if start >= len(body):
+                return self._send(416, b"", "text/plain")
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        view = memoryview(body)
+        for offset in range(start, len(body), DOWNLOAD_CHUNK_SIZE):
+            self.wfile.write(view[offset : offset + DOWNLOAD_CHUNK_SIZE])
+        self.studio.record(self.route, 206 if start else 200)
+
+    def _create_upload(self):
+        self._read_body()
+        upload_id = next(self.studio.upload_ids)
+        host, port = self.server.server_address
+        self.studio.uploads[upload_id] = None
+        signature = urllib.parse.urlencode(
+            {
+                "X-Amz-Date": time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()),
+                "X-Amz-Expires": self.studio.upload_url_ttl,
+            }
+        )
+        self._send_json(
+            201,
+            {
+                "upload": {
+                    "id": upload_id,
+                    "url": f"http://{host}:{port}/presigned/{upload_id}?{signature}",
+                }
+            },
+        )
+
+    def _presigned_put(self, upload_id):
+        size = self._read_body()
+        if int(upload_id) not in self.studio.uploads:
+            return self._send(403, b"<Error>AccessDenied</Error>", "application/xml")
+        signed_at = calendar.timegm(
+            time.strptime(self.params["X-Amz-Date"], "%Y%m%dT%H%M%SZ")
+        )
+        if signed_at + int(self.params["X-Amz-Expires"]) < time.time():
+            return self._send(
+                403,
+                b"<Error><Code>AccessDenied</Code><Message>Request has expired</Message></Error>",
+                "application/xml",
+            )
+        if self.studio.upload_fault():
+            return self._send(500, b"<Error>InternalError</Error>", "application/xml")
+        self.studio.uploads[int(upload_id)] = size
+        self._send(200, b"", "text/plain")
+
+    def _complete_upload(self, upload_id):
+        self._read_body()
+        if self.studio.uploads.get(int(upload_id)) is None:
+            return self._send_json(422, {"error": "the file is not uploaded"})
+        self._send_json(200, {"media": self._media_data(int(upload_id))})
+
+
+def start_mock_studio(studio=None, port=0):
+    server = start_stub_server(MockStudioHandler, port)
+    server.studio = studio or MockStudio()
+    return server
+
+
+def build_schema():
+    """
+    The part of the Studio API schema the mock implements.
+    """
+
+    def parameter(name, location="path", type="integer", required=True):
+        return {
+            "name": name,
+            "in": location,
+            "type": type,
+            "required": required,
+            "description": name.replace("_", " "),
+        }
+
+    def operation(summary, parameters=(), properties=None):
+        responses = {"200": {"description": "OK"}}
+        if properties:
+            responses["200"]["schema"] = {"properties": properties}
+        return {
+            "get": {
+                "summary": summary,
+                "parameters": list(parameters),
+                "responses": responses,
+            }
+        }
+
+    return {
+        "swagger": "2.0",
+        "paths": {
+            "/ping": operation("Ping"),
+            "/courses": operation(
+                "List courses",
+                [
+                    parameter("page", "query", required=False),
+                    parameter("per_page", "query", required=False),
+                ],
+                # the pagination "meta" is left out, or the CLI would take the
+                # listing for a single course
+                {"courses": {"type": "array"}},
+            ),
+            "/courses/{course_id}": operation(
+                "Show course", [parameter("course_id")], {"course": {"type": "object"}}
+            ),
+            "/courses/{course_id}/perspectives": operation(
+                "List perspectives of a course",
+                [parameter("course_id")],
+                {"perspectives": {"type": "array"}},
+            ),
+            "/perspectives/{perspective_id}/insights/overview": operation(
+                "Show insights overview", [parameter("perspective_id", type="string")]
+            ),
+            "/perspectives/{perspective_id}/insights/users": operation(
+                "Show users insights", [parameter("perspective_id", type="string")]
+            ),
+            "/media/{media_id}": operation(
+                "Show media", [parameter("media_id")], {"media": {"type": "object"}}
+            ),
+            "/media/{media_id}/download": {
+                "get": {
+                    "summary": "Download media",
+                    "parameters": [parameter("media_id")],
+                    "responses": {"302": {"description": "Found"}},
+                }
+            },
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs the mock Studio API until it's interrupted"
+    )
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--perspectives", type=int, default=10)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--media", type=int, default=1000)
+    parser.add_argument("--download-size", type=int, default=10 * 1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limited-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=0)
+    parser.add_argument("--upload-url-ttl", type=int, default=3600, help="seconds")
+    parser.add_argument("--upload-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_mock_studio(
+        MockStudio(
+            courses=args.courses,
+            perspectives=args.perspectives,
+            users=args.users,
+            media=args.media,
+            download_size=args.download_size,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            unauthorized_rate=args.unauthorized_rate,
+            rate_limited_rate=args.rate_limited_rate,
+            retry_after=args.retry_after,
+            upload_url_ttl=args.upload_url_ttl,
+            upload_error_rate=args.upload_error_rate,
+        ),
+        args.port,
+    )
+    config_path = write_stub_config(server)
+    print(f"Mock Studio listening on port {server.server_address[1]}")
+    print(f"Config file: {config_path}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        os.remove(config_path)
+        for name, count in sorted(server.studio.stats.items()):
+            print(f"{name:70} {count:8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive needs HTTP/1.1 and a Content-Length on every response
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path.split("?")[0].endswith("/ping"):
+            self._send(200, b"pong", "text/plain")
+        else:
+            self._send(404, json.dumps({"error": "not found"}).encode())
+
+    def _send(self, status, body, content_type="application/json; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(handler_class=StubHandler, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler_class)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def write_stub_config(server, **extra):
+    """
+    Writes a config file pointing to the stub server and returns its path.
+
+    The client builds the host as `{subdomain}.{domain}`, so the loopback
+    address is split over the two fields.
+    """
+    config = {
+        "access_token": "access-token",
+        "client_id": "client-id",
+        "client_secret": "client-secret",
+        "refresh_token": "refresh-token",
+        "subdomain": "127.0.0",
+        "domain": f"1:{server.server_address[1]}",
+        "scheme": "http",
+    }
+    config.update(extra)
+    fd, path = tempfile.mkstemp(prefix="config-", suffix=".json")
+    with os.fdopen(fd, "wt") as f:
+        json.dump(config, f, indent=4, sort_keys=True)
+    return path
@@ -0,0 +1,50 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_server import start_stub_server, write_stub_config
+from utils.utils import PublicAPIClient, request_with_retry
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    server = start_stub_server()
+    config_path = write_stub_config(server, pool_maxsize=args.threads)
+    try:
+        with PublicAPIClient(config_path) as public_api_client:
+            url = f"{public_api_client.scheme}://{public_api_client.subdomain}.{public_api_client.domain}/api/public/v1/ping"
+            headers = {
+                "Authorization": f"Bearer {public_api_client.config['access_token']}"
+            }
+
+            report(
+                "new connection per request",
+                args,
+                lambda _: request_with_retry("get", url, headers=headers),
+            )
+            report(
+                "pooled session",
+                args,
+                lambda _: public_api_client.request("get", "ping"),
+            )
+    finally:
+        server.shutdown()
+        os.remove(config_path)
+
+
+def report(name, args, call):
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        start = time.perf_counter()
+        for response in executor.map(call, range(args.requests)):
+            assert response.status_code == 200
+        elapsed = time.perf_counter() - start
+    print(f"{name:30} {args.requests / elapsed:10.1f} requests/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,45 @@
 import argparse
+import codecs
 import csv
+import os
+import shlex
+import signal
+import socket
+import socketserver
 import sys
 import json
-import io
+import threading
+import time
+import requests
 import tabulate
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from utils.utils import PublicAPIClient, add_default_arguments, enable_debug_logs
+from utils.utils import (
+    CACHE_DIR,
+    PublicAPIClient,
+    add_default_arguments,
+    enable_debug_logs,
+    file_sha256,
+    find_paging_parameters,
+    report_stats,
+    stream_text,
+    write_json_atomically,
+)
+
+DEFAULT_SCHEMA_CACHE_TTL = 24 * 60 * 60
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 3
+STREAM_CHUNK_SIZE = 64 * 1024
+# CSV rows rendered into each table with --table_format
+TABLE_CHUNK_ROWS = 100
+OUTPUT_FORMATS = ["json", "raw", "jsonl"]
+DEFAULT_BATCH_WORKERS = 8
+DAEMON_SOCKET_DIR = os.path.join(CACHE_DIR, "cli")
 
 
 def main():
-    parser = argparse.ArgumentParser(add_help=False)
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
     add_default_arguments(parser)
     parser.add_argument(
         "--debug",
@@ -25,17 +54,76 @@ def main():
         help="tabulated formats",
         choices=list(tabulate._table_formats.keys()),
     )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="json",
+        help="json: pretty printed (default), raw: the response as it arrives, jsonl: the items of the list in the response as JSON lines, as they arrive",
+        choices=OUTPUT_FORMATS,
+    )
+    parser.add_argument(
+        "--refresh-schema",
+        default=False,
+        action="store_true",
+        help="download the API schema even if the cached one is still fresh",
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        help="run the commands of a JSON lines file ('-' for stdin) and print the results as JSON lines",
+    )
+    parser.add_argument(
+        "--batch-workers",
+        type=int,
+        default=DEFAULT_BATCH_WORKERS,
+        help="number of batch commands to run in parallel",
+    )
+    parser.add_argument(
+        "--shell",
+        default=False,
+        action="store_true",
+        help="start an interactive shell running commands on one client",
+    )
+    parser.add_argument(
+        "--daemon",
+        default=False,
+        action="store_true",
+        help="serve commands from bin/cli-client on a Unix socket",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        help="Unix socket of --daemon, by default one per config file in .cache/cli",
+    )
 
     args, unprocessed_args = parser.parse_known_args()
 
     if args.debug:
         enable_debug_logs()
 
+    studio_cli = StudioCli(args.config, refresh_schema=args.refresh_schema)
+
+    if args.batch:
+        with report_stats(studio_cli.public_api_client, args):
+            failed = run_batch(studio_cli, args.batch, args.batch_workers)
+        if failed:
+            sys.exit(1)
+        return
+
+    if args.shell:
+        run_shell(studio_cli)
+        return
+
+    if args.daemon:
+        serve_daemon(studio_cli, args.socket or daemon_socket_path(args.config))
+        return
+
     # We need it for the commands
     subparsers = parser.add_subparsers(help="sub-command help")
 
-    studio_cli = StudioCli(args.config)
-    studio_cli.build_commands(subparsers)
+    studio_cli.build_commands(
+        subparsers, unprocessed_args[0] if unprocessed_args else None
+    )
 
     if not unprocessed_args:
         parser.print_help()
@@ -45,39 +133,412 @@ def main():
 
     command = unprocessed_args[0]
 
-    response = studio_cli.execute(command, args)
+    with report_stats(studio_cli.public_api_client, args):
+        response = studio_cli.execute(command, args)
+
+        if isinstance(response, str):
+            print(response)
+        else:
+            # streamed output, e.g. the items of all pages
+            for chunk in response:
+                sys.stdout.write(chunk)
+                sys.stdout.flush()
+
+
+def run_batch(studio_cli, batch_file, workers):
+    """
+    Runs the commands of a JSON lines file, `workers` at a time, on the same
+    client. Each line is either `{"id": ..., "argv": ["show_media",
+    "--media_id", "1"]}` or `{"id": ..., "command": "show_media", "args":
+    {"media_id": 1}}`.
+
+    The results are printed as JSON lines as soon as they're done, with the
+    `id` of their command (or its line number). Returns the number of failed
+    commands.
+    """
+    failed = 0
+
+    def print_results(futures):
+        nonlocal failed
+        for future in futures:
+            result = future.result()
+            failed += not result["ok"]
+            print(json.dumps(result), flush=True)
+
+    with (
+        sys.stdin if batch_file == "-" else open(batch_file)
+    ) as f, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            pending.add(
+                executor.submit(run_batch_command, studio_cli, line, line_number)
+            )
+            # only read ahead a bit, so a large batch isn't all in memory
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                print_results(done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            print_results(done)
+    return failed
+
+
+def run_batch_command(studio_cli, line, line_number):
+    start = time.monotonic()
+    command_id = line_number
+    try:
+        command = json.loads(line)
+        command_id = command.get("id", line_number)
+        args = studio_cli.parse_command(batch_command_argv(command))
+        output = studio_cli.execute(args.command, args)
+        if isinstance(output, str):
+            result = parse_output(output)
+        else:
+            result = [json.loads(item) for item in output]
+    except HelpRequested as e:
+        result = str(e)
+    except Exception as e:
+        return {
+            "id": command_id,
+            "ok": False,
+            "error": str(e),
+            "elapsed": time.monotonic() - start,
+        }
+    return {
+        "id": command_id,
+        "ok": True,
+        "result": result,
+        "elapsed": time.monotonic() - start,
+    }
+
+
+def batch_command_argv(command):
+    if "argv" in command:
+        return [str(arg) for arg in command["argv"]]
+    argv = [command["command"]]
+    for name, value in command.get("args", {}).items():
+        if value is True:
+            argv.append(f"--{name}")
+        elif value is not None and value is not False:
+            argv += [f"--{name}", str(value)]
+    return argv
+
+
+def parse_output(output):
+    # JSON responses are included as JSON, anything else as text
+    try:
+        return json.loads(output)
+    except ValueError:
+        return output
+
+
+def run_shell(studio_cli):
+    """
+    Reads command lines (as they would be given to `bin/cli`) from the
+    terminal and runs them, until `exit` or end of input.
+    """
+    try:
+        import readline
+
+        readline.set_completer(
+            lambda text, state: (
+                [name for name in studio_cli.command_index if name.startswith(text)]
+                + [None]
+            )[state]
+        )
+        readline.parse_and_bind("tab: complete")
+    except ImportError:
+        pass
+
+    print(
+        "Type 'help' to list the commands, 'help <command>' for its options, 'exit' to quit"
+    )
+    while True:
+        try:
+            line = input("studio> ")
+        except EOFError:
+            print()
+            break
+        except KeyboardInterrupt:
+            print()
+            continue
+
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            print(f"Error: {e}")
+            continue
+        if not argv:
+            continue
+        if argv[0] in ["exit", "quit"]:
+            break
+        if argv == ["help"]:
+            for name, entry in sorted(studio_cli.command_index.items()):
+                print(f"  {name:50} {entry['summary']}")
+            continue
+        if argv[0] == "help":
+            argv = argv[1:] + ["--help"]
+
+        try:
+            for output in run_command_line(studio_cli, argv):
+                print(output, end="", flush=True)
+        except HelpRequested as e:
+            print(e)
+        except KeyboardInterrupt:
+            print("Interrupted")
+        except Exception as e:
+            print(f"Error: {e}")
+
+
+def serve_daemon(studio_cli, socket_path):
+    """
+    Runs commands sent by `cli/client.py` on a Unix socket, until it's
+    stopped with Ctrl-C or SIGTERM. Only the user running it can connect.
+
+    A request is a JSON line `{"argv": [...], "cwd": "..."}`. The response
+    is a JSON line `{"output": "..."}` for every output line, and then
+    `{"exit": 0}` or `{"exit": 1, "error": "..."}`.
+    """
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                # a connection checking if the daemon is running
+                return
+            try:
+                request = json.loads(line)
+                for output in run_command_line(
+                    studio_cli, request["argv"], request.get("cwd")
+                ):
+                    self._send({"output": output})
+            except HelpRequested as e:
+                self._send({"output": str(e)})
+            except BrokenPipeError:
+                return
+            except Exception as e:
+                self._send({"exit": 1, "error": str(e)})
+                return
+            self._send({"exit": 0})
+
+        def _send(self, message):
+            self.wfile.write(json.dumps(message).encode() + b"\n")
+            self.wfile.flush()
+
+    os.makedirs(os.path.dirname(socket_path), mode=0o700, exist_ok=True)
+    if os.path.exists(socket_path):
+        if is_daemon_running(socket_path):
+            sys.exit(f"A daemon is already serving commands on {socket_path}")
+        # left behind by a daemon that didn't stop cleanly
+        os.remove(socket_path)
+    # the socket is created with the permissions left by the umask, so it's
+    # never accessible to others, not even until it could be chmod-ed
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Serving commands on {socket_path}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def is_daemon_running(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except ConnectionRefusedError:
+            return False
+    return True
+
+
+def daemon_socket_path(config_file):
+    # cli/client.py computes the same path without importing this module
+    return os.path.join(DAEMON_SOCKET_DIR, f"{os.path.basename(config_file)}.sock")
+
+
+def run_command_line(studio_cli, argv, cwd=None):
+    """
+    Runs a command line of the shell or the daemon, e.g. `["--table_format",
+    "grid", "show_perspectives_insights_users", "--perspective_id", "..."]`,
+    and yields its output in chunks ending with newlines. Relative `--output`
+    paths are relative to `cwd`.
+    """
+    global_parser = CommandArgumentParser(add_help=False, allow_abbrev=False)
+    global_parser.add_argument("--config")
+    global_parser.add_argument("--socket")
+    global_parser.add_argument(
+        "--table_format", choices=list(tabulate._table_formats.keys())
+    )
+    global_parser.add_argument("--output_format", choices=OUTPUT_FORMATS)
+    global_args, command_argv = global_parser.parse_known_args(argv)
+
+    args = studio_cli.parse_command(command_argv)
+    args.table_format = global_args.table_format
+    args.output_format = global_args.output_format
+    if cwd and getattr(args, "output", None):
+        args.output = os.path.join(cwd, args.output)
+
+    output = studio_cli.execute(args.command, args)
+    if isinstance(output, str):
+        yield output + "\n"
+    else:
+        yield from output
+
+
+class HelpRequested(Exception):
+    """
+    Raised with the help text of a command when it's run with `--help`.
+    """
+
+
+class CommandArgumentParser(argparse.ArgumentParser):
+    """
+    Raises ValueError for invalid arguments, and HelpRequested for `--help`,
+    instead of printing and exiting.
+    """
 
-    print(response)
+    def error(self, message):
+        raise ValueError(message)
+
+    def print_help(self, file=None):
+        raise HelpRequested(self.format_help())
 
 
 class StudioCli:
-    def __init__(self, config):
+    def __init__(self, config, refresh_schema=False):
         self.public_api_client = PublicAPIClient(config)
-        self.schema = self._get_schema()
+        self.schema_cache = SchemaCache(self.public_api_client)
+        self.schema, self.command_index = self._get_schema(refresh_schema)
         self.commands = {}
+        self.command_parsers = {}
+        self.lock = threading.Lock()
 
-    def build_commands(self, subparsers):
-        for path, methods in self.schema["paths"].items():
-            for method, data in methods.items():
-                command = Command(path, method, data, self.public_api_client)
-                if self._is_valid_command(command):
-                    self.commands[command.name] = command
-                    self._extend_subparsers(command, subparsers)
+    def build_commands(self, subparsers, command_name=None):
+        """
+        Adds the subparser of `command_name` with all of its arguments. If it's
+        not a known command, all commands are listed (without their arguments)
+        for the help and error messages.
+        """
+        if command_name in self.command_index:
+            self._extend_subparsers(self.get_command(command_name), subparsers)
+            return
+
+        for name, entry in self.command_index.items():
+            subparsers.add_parser(name, help=entry["summary"])
+
+    def get_command(self, command_name):
+        if command_name not in self.commands:
+            entry = self.command_index[command_name]
+            self.commands[command_name] = Command(
+                entry["path"],
+                entry["method"],
+                self.schema["paths"][entry["path"]][entry["method"]],
+                self.public_api_client,
+                name=command_name,
+            )
+        return self.commands[command_name]
+
+    def parse_command(self, argv):
+        """
+        Parses one command line, e.g. `["show_media", "--media_id", "1"]`, into
+        arguments for `execute`, with the command name in `args.command`.
+        The parser of each command is built once.
+        """
+        if not argv or argv[0] not in self.command_index:
+            raise ValueError(f"Unknown command: {argv[0] if argv else None}")
+        with self.lock:
+            if argv[0] not in self.command_parsers:
+                parser = CommandArgumentParser(prog="cli", add_help=False)
+                parser.set_defaults(table_format=None, output_format=None)
+                self.build_commands(parser.add_subparsers(dest="command"), argv[0])
+                self.command_parsers[argv[0]] = parser
+        return self.command_parsers[argv[0]].parse_args(argv)
 
     def execute(self, command_name, args):
-        command = self.commands[command_name]
+        command = self.get_command(command_name)
         return command.execute(args)
 
+    def _build_command_index(self, schema):
+        """
+        Maps the name of every supported command to its path and method. It's
+        cached together with the schema, so the commands don't have to be
+        worked out from the schema on every run.
+        """
+        command_index = {}
+        for path, methods in schema["paths"].items():
+            for method, data in methods.items():
+                command = Command(path, method, data, self.public_api_client)
+                if self._is_valid_command(command):
+                    command_index[command.name] = {
+                        "path": path,
+                        "method": method,
+                        "summary": command.summary(),
+                    }
+        return command_index
+
     # https://tw.instructuremedia.com/api/public/apidocs
-    def _get_schema(self):
-        response = self.public_api_client.request("get", "apidocs", version_prefix="")
+    def _get_schema(self, refresh_schema=False):
+        cached = self.schema_cache.load()
+        if cached and not refresh_schema and self.schema_cache.is_fresh(cached):
+            return cached["schema"], cached["commands"]
+
+        headers = {}
+        if cached and not refresh_schema:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        try:
+            response = self.public_api_client.request(
+                "get", "apidocs", version_prefix="", headers=headers
+            )
+        except requests.RequestException as e:
+            if not cached:
+                raise
+            sys.stderr.write(
+                f"Could not download the API schema, using cached one: {e}\n"
+            )
+            return cached["schema"], cached["commands"]
+
+        if response.status_code == 304:
+            self.schema_cache.save(
+                cached["schema"],
+                cached["commands"],
+                response.headers.get("ETag", cached.get("etag")),
+                response.headers.get("Last-Modified", cached.get("last_modified")),
+            )
+            return cached["schema"], cached["commands"]
 
         if response.status_code != 200:
+            if cached:
+                sys.stderr.write(
+                    f"Could not download the API schema, using cached one: {response.status_code}\n"
+                )
+                return cached["schema"], cached["commands"]
             raise Exception(
                 f"Could not get details for {response.url}: {response.text}"
             )
 
-        return response.json()
+        schema = response.json()
+        command_index = self._build_command_index(schema)
+        self.schema_cache.save(
+            schema,
+            command_index,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        return schema, command_index
 
     _type_to_type = {
         "integer": int,
@@ -92,7 +553,7 @@ class StudioCli:
         missing_params = [
             parameter
             for parameter in command.path_params
-            if parameter not in command.parameter_names()
+            if parameter not in command.parameter_name_set
         ]
 
         if missing_params:
@@ -120,46 +581,139 @@ class StudioCli:
                 help=param["description"],
             )
 
+        if command.paging_parameters and command.method == "get":
+            command_parser.add_argument(
+                "--all-pages",
+                default=False,
+                action="store_true",
+                help="request all the pages and print the items as JSON lines",
+            )
+
+        if command.is_download_command():
+            command_parser.add_argument(
+                "--output",
+                type=str,
+                help="file to download to, a random name is used by default",
+            )
+            command_parser.add_argument(
+                "--sha256",
+                type=str,
+                help="expected SHA-256 checksum of the downloaded file",
+            )
+
+
+class SchemaCache:
+    """
+    Keeps the downloaded API schema on disk, one file per Studio instance.
+
+    The schema is used without asking the server for `schema_cache_ttl`
+    seconds (set in the config file), after that it's revalidated with its
+    ETag/Last-Modified headers.
+    """
+
+    def __init__(self, public_api_client):
+        self.ttl = public_api_client.config.get(
+            "schema_cache_ttl", DEFAULT_SCHEMA_CACHE_TTL
+        )
+        self.path = os.path.join(
+            CACHE_DIR, "schema", f"{public_api_client.instance_name()}.json"
+        )
+
+    def load(self):
+        try:
+            with open(self.path, "rt") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if "commands" not in cached:
+            return None
+        return cached
+
+    def is_fresh(self, cached):
+        return time.time() - cached["fetched_at"] < self.ttl
+
+    def save(self, schema, commands, etag, last_modified):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_json_atomically(
+            self.path,
+            {
+                "commands": commands,
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched_at": time.time(),
+                "schema": schema,
+            },
+        )
+
 
 class Command:
-    def __init__(self, path, method, data, public_api_client):
+    def __init__(self, path, method, data, public_api_client, name=None):
         self.path = path
         self.method = method
         self.data = data
         self.public_api_client = public_api_client
+        self.parameter_name_set = frozenset(self.parameter_names())
+        self.paging_parameters = find_paging_parameters(self.parameter_name_set)
 
         self.path_params = [
             parameter[1:-1]
             for parameter in self.path.split("/")
             if (parameter and parameter[0] == "{")
         ]
-        path_entities = [
-            parameter
-            for parameter in path.split("/")
-            if (parameter and parameter[0] != "{")
-        ]
-
-        self.name = self._create_command_name(method, path_entities)
+        if name:
+            self.name = name
+        else:
+            path_entities = [
+                parameter
+                for parameter in path.split("/")
+                if (parameter and parameter[0] != "{")
+            ]
+            self.name = self._create_command_name(method, path_entities)
 
     def execute(self, args):
         params = {
             name: value
             for name, value in vars(args).items()
-            if (name in self.parameter_names() and name not in self.path_params)
+            if (name in self.parameter_name_set and name not in self.path_params)
         }
 
+        if self.is_download_command():
+            return self._download(self.path.format(**vars(args)), params, args)
+
+        if getattr(args, "all_pages", False):
+            page_param, per_page_param = self.paging_parameters
+            return (
+                json.dumps(item) + "\n"
+                for item in self.public_api_client.paginate(
+                    self.path.format(**vars(args)),
+                    params=params,
+                    page_param=page_param,
+                    per_page_param=per_page_param,
+                )
+            )
+
         response = self.public_api_client.request(
-            self.method, self.path.format(**vars(args)), params=params
+            self.method,
+            self.path.format(**vars(args)),
+            params=params,
+            stream=self._is_streamed(args),
         )
 
         if response.ok:
             return self._process_response(response, args)
 
-        error_message = (
-            f"{response.status_code}: {json.loads(response.content.decode())['error']}"
+        raise Exception(self._error_message(response))
+
+    def _is_streamed(self, args):
+        if self.method != "get":
+            return False
+        output_format = getattr(args, "output_format", None) or "json"
+        return output_format != "json" or bool(
+            self._is_csv_command() and getattr(args, "table_format", None)
         )
 
-        raise Exception(error_message)
+    def is_download_command(self):
+        return self.name.startswith("download_")
 
     def parameter_names(self):
         return [parameter["name"] for parameter in self.parameters()]
@@ -227,6 +781,165 @@ class Command:
             else:
                 return command_name
 
+    def _stream_raw(self, response):
+        """
+        Passes the response through as it arrives, without parsing it.
+        """
+        with response:
+            last = ""
+            for chunk in iter_text(response):
+                yield chunk
+                last = chunk or last
+            if not last.endswith("\n"):
+                yield "\n"
+
+    def _stream_json_items(self, response):
+        with response:
+            for item in iter_json_items(iter_text(response)):
+                yield json.dumps(item) + "\n"
+
+    def _stream_table(self, response, table_format):
+        """
+        Renders the CSV response as tables of `TABLE_CHUNK_ROWS` rows, each
+        with the header, so rows are printed as they arrive and only one table
+        is kept in memory.
+        """
+        with response:
+            reader = csv.reader(stream_text(response))
+            header = next(reader, [])
+            rows = []
+            printed = False
+            for row in reader:
+                rows.append(row)
+                if len(rows) == TABLE_CHUNK_ROWS:
+                    yield tabulate.tabulate(
+                        rows, headers=header, tablefmt=table_format
+                    ) + "\n"
+                    rows = []
+                    printed = True
+            # a CSV without rows is still printed, as a table of the header
+            if rows or not printed:
+                yield tabulate.tabulate(
+                    rows, headers=header, tablefmt=table_format
+                ) + "\n"
+
+    def _error_message(self, response):
+        return (
+            f"{response.status_code}: {json.loads(response.content.decode())['error']}"
+        )
+
+    def _download(self, url, params, args):
+        """
+        Streams the response to `<output>.part` and renames it when it's
+        complete. If the connection breaks, or `--output` points to an
+        unfinished download, the download is continued with a Range request.
+        """
+        output_filename = args.output
+        content_type = None
+        downloaded = 0
+        start = time.monotonic()
+
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            partial_filename = output_filename and f"{output_filename}.part"
+            offset = 0
+            if partial_filename and os.path.exists(partial_filename):
+                offset = os.path.getsize(partial_filename)
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+            try:
+                with self.public_api_client.request(
+                    self.method, url, params=params, headers=headers, stream=True
+                ) as response:
+                    if response.status_code == 416 and offset:
+                        # the previous run got the whole file, just didn't rename it
+                        total = offset
+                        break
+                    if not response.ok:
+                        raise Exception(self._error_message(response))
+
+                    content_type = response.headers["Content-Type"].split(";")[0]
+                    if output_filename is None:
+                        output_filename = self._default_download_filename(content_type)
+                        partial_filename = f"{output_filename}.part"
+                    if response.status_code != 206:
+                        offset = 0
+                    total = self._download_size(response, offset)
+
+                    # `offset` already includes the bytes of earlier attempts
+                    received = 0
+                    with open(partial_filename, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                            received += len(chunk)
+                            downloaded += len(chunk)
+                            self._report_progress(
+                                offset + received, total, downloaded, start
+                            )
+                    if total is not None and os.path.getsize(partial_filename) < total:
+                        raise requests.ConnectionError(
+                            "connection closed before the download was complete"
+                        )
+                break
+            except (
+                requests.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                if attempt == DOWNLOAD_RETRIES or partial_filename is None:
+                    raise
+                sys.stderr.write(f"\nDownload interrupted, resuming: {e}\n")
+
+        if sys.stderr.isatty():
+            sys.stderr.write("\n")
+
+        size = os.path.getsize(partial_filename)
+        if total is not None and size != total:
+            raise Exception(
+                f"Downloaded {size} bytes instead of {total}, run the command again to resume"
+            )
+        if args.sha256:
+            checksum = file_sha256(partial_filename)
+            if checksum != args.sha256.lower():
+                os.remove(partial_filename)
+                raise Exception(
+                    f"Checksum mismatch: expected {args.sha256}, got {checksum}"
+                )
+        os.replace(partial_filename, output_filename)
+
+        elapsed = time.monotonic() - start
+        return (
+            f"Downloaded {content_type or 'existing'} content to {output_filename} "
+            f"({size} bytes, {downloaded / elapsed / 1024 / 1024:.1f} MB/s)"
+        )
+
+    def _default_download_filename(self, content_type):
+        if content_type in ["video/mp4", "audio/mp4"]:
+            extension = "mp4"
+        else:
+            # for captions it's text/plain
+            extension = "str"
+
+        return f"{str(uuid.uuid4())}.{extension}"
+
+    def _download_size(self, response, offset):
+        # Content-Range: bytes 1000-4999/5000
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            return int(total) if total != "*" else None
+        if "Content-Length" in response.headers:
+            return offset + int(response.headers["Content-Length"])
+        return None
+
+    def _report_progress(self, done, total, downloaded, start):
+        # `done` is the size of the file so far, `downloaded` the bytes this
+        # run received, which the rate is computed from
+        if not sys.stderr.isatty():
+            return
+        elapsed = time.monotonic() - start
+        rate = downloaded / elapsed / 1024 / 1024 if elapsed else 0
+        progress = f"{done / total:.0%} of {total} bytes" if total else f"{done} bytes"
+        sys.stderr.write(f"\r{progress}, {rate:.1f} MB/s")
+
     def _is_csv_command(self):
         return self.name in [
             "show_perspectives_insights_overview",
@@ -236,33 +949,19 @@ class Command:
     def _process_response(self, response, args):
         # can be 'application/json; charset=utf-8' or 'video/mp4'
         content_type = response.headers["Content-Type"].split(";")
-        if content_type[0] == "application/json":
-            return json.dumps(response.json(), indent=2)
-
-        if self.name.startswith("download_"):
-            if content_type[0] in ["video/mp4", "audio/mp4"]:
-                extension = "mp4"
-            else:
-                # for captions it's text/plain
-                extension = "str"
-
-            output_filename = f"{str(uuid.uuid4())}.{extension}"
-            with open(output_filename, "wb") as tf:
-                tf.write(response.content)
-
-            return f"Downloaded {content_type} content to {output_filename}"
+        output_format = getattr(args, "output_format", None) or "json"
 
         if self._is_csv_command() and args.table_format:
-            result = []
+            return self._stream_table(response, args.table_format)
 
-            csv_string = response.content.decode()
-            reader = csv.reader(io.StringIO(csv_string))
+        if output_format == "jsonl" and content_type[0] == "application/json":
+            return self._stream_json_items(response)
 
-            header = next(reader)
-            for row in reader:
-                result.append(row)
+        if response.raw is not None and self._is_streamed(args):
+            return self._stream_raw(response)
 
-            return tabulate.tabulate(result, headers=header, tablefmt=args.table_format)
+        if content_type[0] == "application/json":
+            return json.dumps(response.json(), indent=2)
 
         if self.method != "get" and not response.content:
             message = self.data["responses"].get(str(response.status_code), "")
@@ -271,5 +970,102 @@ class Command:
         return response.content.decode()
 
 
+def iter_text(response):
+    """
+    Yields the body of a streamed response as text, decoded as UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def iter_json_items(chunks):
+    """
+    Parses a JSON document arriving in text `chunks` incrementally, and yields
+    the items of its list: the document itself if it's a list, or the first
+    list value of an object (e.g. `{"media": [...], "meta": {...}}`). Other
+    documents are yielded whole. Only the item being parsed is kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    exhausted = False
+
+    def fill():
+        # reads more text, returns False at the end of the document
+        nonlocal buffer, position, exhausted
+        if exhausted:
+            return False
+        buffer = buffer[position:]
+        position = 0
+        try:
+            buffer += next(chunks)
+        except StopIteration:
+            exhausted = True
+        return True
+
+    def skip(characters):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+            if position < len(buffer) or not fill():
+                return
+
+    def peek():
+        skip(" \t\r\n")
+        return buffer[position] if position < len(buffer) else None
+
+    def decode():
+        # a value is only complete if a delimiter follows it, e.g. `-4` could
+        # be the start of `-4.5e10` in the next chunk
+        nonlocal position
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                if exhausted or (end < len(buffer) and buffer[end] in " \t\r\n,:]}"):
+                    position = end
+                    return value
+            except ValueError:
+                if exhausted:
+                    raise
+            fill()
+
+    def list_items():
+        nonlocal position
+        position += 1
+        while peek() not in ["]", None]:
+            yield decode()
+            if peek() == ",":
+                position += 1
+
+    first = peek()
+    if first == "[":
+        yield from list_items()
+        return
+    if first != "{":
+        yield decode()
+        return
+
+    # look for the first list among the values of the object, the values
+    # before it are kept in case there is none
+    document = {}
+    position += 1
+    while peek() not in ["}", None]:
+        key = decode()
+        if peek() != ":":
+            raise ValueError(f"Invalid JSON after the key {key!r}")
+        position += 1
+        if peek() == "[":
+            yield from list_items()
+            return
+        document[key] = decode()
+        if peek() == ",":
+            position += 1
+    yield document
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,59 @@
+import json
+import os
+import socket
+import sys
+
+
+# the same as in utils/utils.py and cli/cli.py, which aren't imported here so
+# the client starts without loading requests and the API schema
+DEFAULT_CONFIG_FILE = "config.json"
+CACHE_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", ".cache"))
+DAEMON_SOCKET_DIR = os.path.join(CACHE_DIR, "cli")
+
+
+def main():
+    """
+    Forwards the command line to the daemon started with `bin/cli --daemon`
+    and prints its output. Without a running daemon, the command is run by
+    `bin/cli` itself.
+    """
+    argv = sys.argv[1:]
+    socket_path = option_value(argv, "--socket") or os.path.join(
+        DAEMON_SOCKET_DIR,
+        f"{os.path.basename(option_value(argv, '--config') or DEFAULT_CONFIG_FILE)}.sock",
+    )
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        connection.close()
+        cli_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+        os.execv(sys.executable, [sys.executable, cli_path] + argv)
+
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode() + b"\n")
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "output" in message:
+                sys.stdout.write(message["output"])
+                sys.stdout.flush()
+            if "exit" in message:
+                if message.get("error"):
+                    sys.stderr.write(f"{message['error']}\n")
+                sys.exit(message["exit"])
+    sys.exit("The daemon closed the connection")
+
+
+def option_value(argv, name):
+    for index, arg in enumerate(argv):
+        if arg == name and index + 1 < len(argv):
+            return argv[index + 1]
+        if arg.startswith(f"{name}="):
+            return arg[len(name) + 1 :]
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import sqlite3
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS courses (
+    course_id INTEGER PRIMARY KEY,
+    canvas_course_id INTEGER,
+    name TEXT,
+    synced_at REAL
+);
+CREATE TABLE IF NOT EXISTS perspectives (
+    course_id INTEGER,
+    perspective_uuid TEXT,
+    title TEXT,
+    position INTEGER,
+    PRIMARY KEY (course_id, perspective_uuid)
+);
+CREATE TABLE IF NOT EXISTS insights (
+    course_id INTEGER,
+    perspective_uuid TEXT,
+    kind TEXT,
+    content_hash TEXT,
+    etag TEXT,
+    synced_at REAL,
+    PRIMARY KEY (course_id, perspective_uuid, kind)
+);
+CREATE TABLE IF NOT EXISTS overviews (
+    course_id INTEGER,
+    perspective_uuid TEXT,
+    views TEXT,
+    time_viewed TEXT,
+    unique_viewers TEXT,
+    PRIMARY KEY (course_id, perspective_uuid)
+);
+CREATE TABLE IF NOT EXISTS user_insights (
+    course_id INTEGER,
+    perspective_uuid TEXT,
+    row_number INTEGER,
+    name TEXT,
+    email TEXT,
+    role TEXT,
+    completion_rate TEXT,
+    PRIMARY KEY (course_id, perspective_uuid, row_number)
+);
+"""
+
+BATCH_SIZE = 1000
+
+
+class InsightsStore:
+    """
+    Local SQLite copy of the insights of courses. Every insights CSV is
+    stored with its content hash and ETag, so unchanged insights don't have
+    to be written (or, if the server supports it, downloaded) again.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def update_course(self, course_id, course, perspectives):
+        """
+        Saves the course and its perspectives, and removes the insights of
+        perspectives that are no longer in the course.
+        """
+        uuids = [perspective["uuid"] for perspective in perspectives]
+        with self.connection:
+            self.connection.execute(
+                """
+                INSERT INTO courses (course_id, canvas_course_id, name, synced_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (course_id) DO UPDATE SET
+                    canvas_course_id = excluded.canvas_course_id,
+                    name = excluded.name,
+                    synced_at = excluded.synced_at
+                """,
+                (course_id, course["course_id"], course["name"], time.time()),
+            )
+            self.connection.executemany(
+                """
+                INSERT INTO perspectives (course_id, perspective_uuid, title, position)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (course_id, perspective_uuid) DO UPDATE SET
+                    title = excluded.title,
+                    position = excluded.position
+                """,
+                [
+                    (course_id, perspective["uuid"], perspective["title"], position)
+                    for position, perspective in enumerate(perspectives)
+                ],
+            )
+            placeholders = ", ".join("?" * len(uuids))
+            for table in ["perspectives", "insights", "overviews", "user_insights"]:
+                self.connection.execute(
+                    f"""
+                    DELETE FROM {table}
+                    WHERE course_id = ? AND perspective_uuid NOT IN ({placeholders})
+                    """,
+                    [course_id, *uuids],
+                )
+
+    def get_canvas_course_id(self, course_id):
+        row = self.connection.execute(
+            "SELECT canvas_course_id FROM courses WHERE course_id = ?", (course_id,)
+        ).fetchone()
+        if row is None:
+            raise Exception(f"Course {course_id} is not in the store, sync it first")
+        return row[0]
+
+    def get_insights_state(self, course_id, perspective_uuid, kind):
+        """
+        Returns `(content_hash, etag)` of the stored insights, or `(None, None)`.
+        """
+        row = self.connection.execute(
+            """
+            SELECT content_hash, etag FROM insights
+            WHERE course_id = ? AND perspective_uuid = ? AND kind = ?
+            """,
+            (course_id, perspective_uuid, kind),
+        ).fetchone()
+        return row or (None, None)
+
+    def save_overview(self, course_id, perspective_uuid, content_hash, etag, values):
+        with self.connection:
+            self.connection.execute(
+                """
+                INSERT INTO overviews
+                    (course_id, perspective_uuid, views, time_viewed, unique_viewers)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (course_id, perspective_uuid) DO UPDATE SET
+                    views = excluded.views,
+                    time_viewed = excluded.time_viewed,
+                    unique_viewers = excluded.unique_viewers
+                """,
+                (course_id, perspective_uuid, *values),
+            )
+            self._save_state(
+                course_id, perspective_uuid, "overview", content_hash, etag
+            )
+
+    def save_user_insights(self, course_id, perspective_uuid, content_hash, etag, rows):
+        """
+        Replaces the users insights of the perspective with `rows` (dicts of
+        the users CSV), inserted in batches in one transaction.
+        """
+        with self.connection:
+            self.connection.execute(
+                """
+                DELETE FROM user_insights
+                WHERE course_id = ? AND perspective_uuid = ?
+                """,
+                (course_id, perspective_uuid),
+            )
+            batch = []
+            for row_number, row in enumerate(rows):
+                batch.append(
+                    (
+                        course_id,
+                        perspective_uuid,
+                        row_number,
+                        row["Name"],
+                        row["Email"],
+                        row["Role"],
+                        row["Completion rate [%]"],
+                    )
+                )
+                if len(batch) == BATCH_SIZE:
+                    self._insert_user_insights(batch)
+                    batch = []
+            self._insert_user_insights(batch)
+            self._save_state(course_id, perspective_uuid, "users", content_hash, etag)
+
+    def touch_insights(self, course_id, perspective_uuid, kind):
+        with self.connection:
+            self.connection.execute(
+                """
+                UPDATE insights SET synced_at = ?
+                WHERE course_id = ? AND perspective_uuid = ? AND kind = ?
+                """,
+                (time.time(), course_id, perspective_uuid, kind),
+            )
+
+    def summary_rows(self, course_ids):
+        for course_id in course_ids:
+            yield from self.connection.execute(
+                """
+                SELECT c.canvas_course_id, c.name, p.perspective_uuid, p.title,
+                       o.views, o.time_viewed, o.unique_viewers
+                FROM perspectives p
+                JOIN courses c ON c.course_id = p.course_id
+                JOIN overviews o
+                    ON o.course_id = p.course_id
+                    AND o.perspective_uuid = p.perspective_uuid
+                WHERE p.course_id = ?
+                ORDER BY p.position
+                """,
+                (course_id,),
+            )
+
+    def user_rows(self, course_ids):
+        for course_id in course_ids:
+            yield from self.connection.execute(
+                """
+                SELECT c.canvas_course_id, c.name, p.perspective_uuid, p.title,
+                       u.name, u.email, u.role, u.completion_rate
+                FROM perspectives p
+                JOIN courses c ON c.course_id = p.course_id
+                JOIN user_insights u
+                    ON u.course_id = p.course_id
+                    AND u.perspective_uuid = p.perspective_uuid
+                WHERE p.course_id = ?
+                ORDER BY p.position, u.row_number
+                """,
+                (course_id,),
+            )
+
+    def _insert_user_insights(self, batch):
+        self.connection.executemany(
+            """
+            INSERT INTO user_insights
+                (course_id, perspective_uuid, row_number,
+                 name, email, role, completion_rate)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            batch,
+        )
+
+    def _save_state(self, course_id, perspective_uuid, kind, content_hash, etag):
+        self.connection.execute(
+            """
+            INSERT INTO insights
+                (course_id, perspective_uuid, kind, content_hash, etag, synced_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (course_id, perspective_uuid, kind) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                etag = excluded.etag,
+                synced_at = excluded.synced_at
+            """,
+            (course_id, perspective_uuid, kind, content_hash, etag, time.time()),
+        )
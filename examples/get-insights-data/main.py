@@ -1,103 +1,531 @@
 import os
+import collections
 import csv
-from utils.utils import PublicAPIClient, get_commandline_arguments
+import json
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from insights_store import InsightsStore
+from utils.sinks import FLOAT, FORMATS, INTEGER, STRING, open_sink, output_path
+from utils.utils import (
+    PublicAPIClient,
+    file_sha256,
+    get_commandline_arguments,
+    imap_ordered,
+    report_stats,
+    stream_text,
+)
 
 
 def main():
     args = get_commandline_arguments(
         [
             (
-                ["course_id"],
-                {"type": int, "help": "id of the course to get insights for"},
-            )
+                ["course_ids"],
+                {
+                    "type": int,
+                    "nargs": "*",
+                    "metavar": "course_id",
+                    "help": "id of the course(s) to get insights for",
+                },
+            ),
+            (
+                ["--course-file"],
+                {"type": str, "help": "file with one course id per line"},
+            ),
+            (
+                ["--all-courses"],
+                {
+                    "default": False,
+                    "action": "store_true",
+                    "help": "get insights for every course listed by the API",
+                },
+            ),
+            (
+                ["--workers"],
+                {
+                    "type": int,
+                    "default": 8,
+                    "help": "number of insights requests to run in parallel",
+                },
+            ),
+            (
+                ["--course-workers"],
+                {
+                    "type": int,
+                    "default": 4,
+                    "help": "number of courses to export in parallel when exporting multiple courses",
+                },
+            ),
+            (
+                ["--format"],
+                {
+                    "choices": FORMATS,
+                    "default": "csv",
+                    "help": "format of the output files (parquet needs pyarrow)",
+                },
+            ),
+            (
+                ["--store"],
+                {
+                    "type": str,
+                    "help": "SQLite database to sync the insights into, the output files are written from it",
+                },
+            ),
+            (
+                ["--from-store"],
+                {
+                    "default": False,
+                    "action": "store_true",
+                    "help": "write the output files from the --store database without syncing it",
+                },
+            ),
         ]
     )
-    public_api_client = PublicAPIClient(args.config)
-    perspectives = fetch_course_perspectives(public_api_client, args.course_id)
-    course_data = fetch_course_data(public_api_client, args.course_id)
+    with PublicAPIClient(args.config) as public_api_client, report_stats(
+        public_api_client, args
+    ):
+        course_ids = list(args.course_ids)
+        if args.course_file:
+            with open(args.course_file) as f:
+                course_ids += [int(line) for line in f if line.strip()]
+        if not course_ids and not args.all_courses:
+            sys.exit("Please specify at least one course")
+
+        if args.store:
+            if args.all_courses:
+                course_ids += list_all_course_ids(public_api_client)
+            export_with_store(public_api_client, course_ids, args)
+        elif len(course_ids) == 1 and not (args.course_file or args.all_courses):
+            export_course(public_api_client, course_ids[0], args.workers, args.format)
+        else:
+            export_courses(
+                public_api_client,
+                course_ids,
+                args.all_courses,
+                args.workers,
+                args.course_workers,
+                args.format,
+            )
+
+
+def list_all_course_ids(public_api_client):
+    return [course["id"] for course in public_api_client.paginate("courses")]
+
+
+def export_with_store(public_api_client, course_ids, args):
+    store = InsightsStore(args.store)
+    try:
+        if not args.from_store:
+            sync_store(public_api_client, store, course_ids, args.workers)
+
+        if len(course_ids) == 1:
+            suffix = f"-{store.get_canvas_course_id(course_ids[0])}"
+        else:
+            suffix = ""
+        with open_output(
+            "summary", f"{public_api_client.subdomain}{suffix}", args.format
+        ) as summary_sink:
+            summary_sink.writerows(store.summary_rows(course_ids))
+        with open_output(
+            "users", f"{public_api_client.subdomain}{suffix}", args.format
+        ) as users_sink:
+            users_sink.writerows(store.user_rows(course_ids))
+    finally:
+        store.close()
+
+
+def sync_store(public_api_client, store, course_ids, workers):
+    """
+    Updates the insights of the courses in the store. Insights that haven't
+    changed since the last sync (same ETag or same content hash) are not
+    written again.
+    """
+    stats = collections.Counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for course_id in course_ids:
+            perspectives = fetch_course_perspectives(public_api_client, course_id)
+            course_data = fetch_course_data(public_api_client, course_id)
+            store.update_course(course_id, course_data, perspectives)
+
+            # the store is only used from this thread, the workers get its state
+            states = [
+                (
+                    perspective,
+                    {
+                        kind: store.get_insights_state(
+                            course_id, perspective["uuid"], kind
+                        )
+                        for kind in INSIGHTS_KINDS
+                    },
+                )
+                for perspective in perspectives
+            ]
+            for perspective, changes in imap_ordered(
+                executor,
+                partial(fetch_changed_insights, public_api_client),
+                states,
+                workers * 2,
+            ):
+                for kind, change in changes.items():
+                    if change is None:
+                        stats["unchanged"] += 1
+                        store.touch_insights(course_id, perspective["uuid"], kind)
+                        continue
+
+                    stats["updated"] += 1
+                    content_hash, etag, csv_file = change
+                    with csv_file:
+                        if kind == "overview":
+                            store.save_overview(
+                                course_id,
+                                perspective["uuid"],
+                                content_hash,
+                                etag,
+                                get_summary_values(list(csv.reader(csv_file))),
+                            )
+                        else:
+                            store.save_user_insights(
+                                course_id,
+                                perspective["uuid"],
+                                content_hash,
+                                etag,
+                                csv.DictReader(csv_file),
+                            )
+            print(f"Synced course {course_id}")
+    print(f"Updated {stats['updated']} insights, {stats['unchanged']} were unchanged")
+
+
+INSIGHTS_KINDS = ["overview", "users"]
 
-    construct_summary(public_api_client, perspectives, course_data)
-    construct_user_insights(public_api_client, perspectives, course_data)
+
+def fetch_changed_insights(public_api_client, perspective_state):
+    """
+    Returns the perspective and, for each kind of insights, None if they
+    haven't changed, or `(content_hash, etag, csv_file)`.
+    """
+    perspective, state = perspective_state
+    print(f"Collecting insights for perspective {perspective['uuid']}")
+    changes = {}
+    for kind in INSIGHTS_KINDS:
+        content_hash, etag = state[kind]
+        csv_file, new_etag = download_csv_if_changed(
+            public_api_client,
+            f"perspectives/{perspective['uuid']}/insights/{kind}",
+            etag,
+        )
+        if csv_file is None:
+            changes[kind] = None
+            continue
+
+        # the file is written as UTF-8, so its bytes are the encoded CSV
+        csv_file.seek(0)
+        new_content_hash = file_sha256(csv_file.fileno())
+        csv_file.seek(0)
+        if new_content_hash == content_hash:
+            csv_file.close()
+            changes[kind] = None
+        else:
+            changes[kind] = (new_content_hash, new_etag, csv_file)
+    return perspective, changes
+
+
+def export_course(public_api_client, course_id, workers, format):
+    perspectives = fetch_course_perspectives(public_api_client, course_id)
+    course_data = fetch_course_data(public_api_client, course_id)
+
+    suffix = f"{public_api_client.subdomain}-{course_data['course_id']}"
+    with open_output("summary", suffix, format) as summary_writer, open_output(
+        "users", suffix, format
+    ) as users_writer, ThreadPoolExecutor(max_workers=workers) as executor:
+        write_insights(
+            public_api_client,
+            perspectives,
+            course_data,
+            summary_writer,
+            users_writer,
+            executor,
+            workers,
+        )
+
+
+def export_courses(
+    public_api_client, course_ids, all_courses, workers, course_workers, format
+):
+    """
+    Exports the insights of many courses into one summary and one users file:
+    `course_ids`, followed by every course the API lists if `all_courses`.
+
+    Courses are exported in parallel into temporary files, which are appended
+    to the outputs in the order of `course_ids`. After every course, the
+    positions of the ends of the outputs are saved in a checkpoint file, so if
+    the export is interrupted, running it again truncates the outputs to the
+    last complete course and continues from there. The checkpoint only
+    resumes an export of the same courses, in the same format and into the
+    same outputs, and only if the outputs still exist. The courses listed by
+    the API are saved in it, so a resumed export doesn't list them again and
+    exports the same ones even if courses were added since.
+    """
+    checkpoint = ExportCheckpoint(f"insights-{public_api_client.subdomain}.checkpoint")
+    outputs = {
+        name: os.path.realpath(output_file(name, public_api_client.subdomain, format))
+        for name in ["summary", "users"]
+    }
+    export = {
+        "course_ids": course_ids,
+        "all_courses": all_courses,
+        "format": format,
+        "outputs": outputs,
+    }
+    if checkpoint.export is not None and checkpoint.export != export:
+        sys.exit(
+            f"{checkpoint.path} is the checkpoint of an export of other courses, "
+            "in another format or into other outputs, run the same export to resume it, "
+            "or remove the checkpoint to start over"
+        )
+    if checkpoint.done and format == "parquet":
+        print("Parquet outputs can't be resumed, exporting every course again")
+        checkpoint.remove()
+    missing_outputs = [path for path in outputs.values() if not os.path.exists(path)]
+    if checkpoint.done and missing_outputs:
+        sys.exit(
+            f"The outputs {missing_outputs} of the export in {checkpoint.path} are missing, "
+            "remove the checkpoint to start over"
+        )
+    if checkpoint.export is None:
+        if all_courses:
+            course_ids = course_ids + list_all_course_ids(public_api_client)
+        if not course_ids:
+            sys.exit("There are no courses to export")
+        checkpoint.start(export, course_ids)
+    course_ids = checkpoint.course_ids
+    remaining_course_ids = [
+        course_id for course_id in course_ids if course_id not in checkpoint.done
+    ]
+    if checkpoint.done:
+        print(
+            f"Resuming export, {len(course_ids) - len(remaining_course_ids)} courses are already done"
+        )
+
+    summary_position, users_position = checkpoint.last_positions()
+    failed_course_ids = []
+    started_at = time.monotonic()
+    with open_output(
+        "summary", public_api_client.subdomain, format, summary_position
+    ) as summary_sink, open_output(
+        "users", public_api_client.subdomain, format, users_position
+    ) as users_sink, ThreadPoolExecutor(
+        max_workers=workers
+    ) as perspective_executor, ThreadPoolExecutor(
+        max_workers=course_workers
+    ) as course_executor:
+        export = partial(
+            export_course_to_temporary_files,
+            public_api_client,
+            perspective_executor,
+            workers,
+        )
+        for done, (course_id, result) in enumerate(
+            imap_ordered(
+                course_executor, export, remaining_course_ids, course_workers * 2
+            ),
+            start=1,
+        ):
+            if isinstance(result, Exception):
+                print(f"Could not export course {course_id}: {result}")
+                failed_course_ids.append(course_id)
+            else:
+                for sink, temporary_file in zip([summary_sink, users_sink], result):
+                    with temporary_file:
+                        sink.writerows(csv.reader(temporary_file))
+                checkpoint.add(course_id, summary_sink.sync(), users_sink.sync())
+                print(f"Exported course {course_id}")
+
+            elapsed = time.monotonic() - started_at
+            eta = elapsed / done * (len(remaining_course_ids) - done)
+            print(
+                f"[{done}/{len(remaining_course_ids)}] "
+                f"{done / elapsed * 60:.1f} courses/min, ETA {eta / 60:.1f} min"
+            )
+
+    if failed_course_ids:
+        sys.exit(
+            f"Could not export {len(failed_course_ids)} courses: {failed_course_ids}, run the script again to retry them"
+        )
+    checkpoint.remove()
+
+
+def export_course_to_temporary_files(
+    public_api_client, perspective_executor, workers, course_id
+):
+    """
+    Returns `(course_id, (summary_file, users_file))` with the rows of the
+    course in rewound temporary files, or `(course_id, exception)`.
+    """
+    try:
+        perspectives = fetch_course_perspectives(public_api_client, course_id)
+        course_data = fetch_course_data(public_api_client, course_id)
+        summary_file, users_file = [
+            tempfile.TemporaryFile("w+", encoding="utf-8", newline="") for _ in range(2)
+        ]
+        write_insights(
+            public_api_client,
+            perspectives,
+            course_data,
+            csv.writer(summary_file),
+            csv.writer(users_file),
+            perspective_executor,
+            workers,
+        )
+    except Exception as e:
+        return course_id, e
+    summary_file.seek(0)
+    users_file.seek(0)
+    return course_id, (summary_file, users_file)
+
+
+class ExportCheckpoint:
+    """
+    JSON lines of the exported courses with the positions of the ends of the
+    outputs after they were written. The first line describes the export
+    (`export`), e.g. the courses requested, so a different export doesn't
+    resume it, and has the ids of all the courses to export (`course_ids`).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.export = None
+        self.course_ids = None
+        self.done = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for number, line in enumerate(f):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line can be cut short by a crash
+                        break
+                    if number == 0:
+                        # checkpoints without it are of an unknown export
+                        self.export = entry.get("export", {})
+                        self.course_ids = entry.get("course_ids")
+                    else:
+                        self.done[entry["course_id"]] = entry
+
+    def start(self, export, course_ids):
+        # a new checkpoint, or one whose first line was cut short
+        self._append({"export": export, "course_ids": course_ids}, "w")
+        self.export = export
+        self.course_ids = course_ids
+
+    def last_positions(self):
+        """
+        Returns the positions of the outputs after the last exported course,
+        or `(None, None)` if there is none and the outputs have to be created.
+        """
+        if not self.done:
+            return None, None
+        last = list(self.done.values())[-1]
+        return last["summary_position"], last["users_position"]
+
+    def add(self, course_id, summary_position, users_position):
+        entry = {
+            "course_id": course_id,
+            "summary_position": summary_position,
+            "users_position": users_position,
+        }
+        self._append(entry)
+        self.done[course_id] = entry
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.export = None
+        self.course_ids = None
+        self.done = {}
+
+    def _append(self, entry, mode="a"):
+        with open(self.path, mode) as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
 
 
 def fetch_course_perspectives(public_api_client, course_id):
     response = public_api_client.request("get", f"courses/{course_id}/perspectives")
+    if response.status_code != 200:
+        raise Exception(
+            f"Could not get perspectives of course {course_id}: {response.text}"
+        )
     return response.json()["perspectives"]
 
 
 def fetch_course_data(public_api_client, course_id):
     response = public_api_client.request("get", f"courses/{course_id}")
+    if response.status_code != 200:
+        raise Exception(f"Could not get course {course_id}: {response.text}")
     return response.json()["course"]
 
 
-def construct_summary(public_api_client, perspectives, course):
-    headers = [
-        "Course ID",
-        "Course Title",
-        "Perspective UUID",
-        "Perspective Title",
-        "Views",
-        "Time Viewed [min]",
-        "Unique Viewers",
-    ]
-    csv_data = []
-    for perspective in perspectives:
-        perspective_data = [
-            course["course_id"],
-            course["name"],
-            perspective["uuid"],
-            perspective["title"],
-        ]
-        print(f"Collecting insights summary for perspective {perspective['uuid']}")
-        summary_csv = list(
-            get_csv(
-                public_api_client,
-                f"perspectives/{perspective['uuid']}/insights/overview",
-            )
-        )
-        csv_data.append(
-            perspective_data
-            + [
-                get_value_from_row(summary_csv[1], "Views", 0),
-                get_value_from_row(summary_csv[2], "Time Viewed [min]", 0),
-                get_value_from_row(summary_csv[3], "Unique Viewers", 0),
-            ]
-        )
+SUMMARY_COLUMNS = [
+    ("Course ID", INTEGER),
+    ("Course Title", STRING),
+    ("Perspective UUID", STRING),
+    ("Perspective Title", STRING),
+    ("Views", INTEGER),
+    ("Time Viewed [min]", FLOAT),
+    ("Unique Viewers", INTEGER),
+]
 
-    write_csv_file(
-        f"summary-{public_api_client.subdomain}-{course['course_id']}.csv",
-        headers,
-        csv_data,
-    )
+USERS_COLUMNS = [
+    ("Course ID", INTEGER),
+    ("Course Title", STRING),
+    ("Perspective UUID", STRING),
+    ("Perspective Title", STRING),
+    ("Name", STRING),
+    ("Email", STRING),
+    ("Role", STRING),
+    ("Completion rate", FLOAT),
+]
 
+OUTPUT_COLUMNS = {"summary": SUMMARY_COLUMNS, "users": USERS_COLUMNS}
 
-def construct_user_insights(public_api_client, perspectives, course):
-    headers = [
-        "Course ID",
-        "Course Title",
-        "Perspective UUID",
-        "Perspective Title",
-        "Name",
-        "Email",
-        "Role",
-        "Completion rate",
-    ]
-    csv_data = []
-    for perspective in perspectives:
+
+def write_insights(
+    public_api_client,
+    perspectives,
+    course,
+    summary_writer,
+    users_writer,
+    executor,
+    workers,
+):
+    """
+    Writes the summary and the users rows of a course in one pass.
+
+    The insights of the perspectives are fetched in parallel, the users CSVs
+    are streamed to temporary files by the workers and copied to the output
+    row by row in the order of `perspectives`, so memory use doesn't depend on
+    the size of the course.
+    """
+    for perspective, summary, users_file in imap_ordered(
+        executor,
+        partial(fetch_perspective_insights, public_api_client),
+        perspectives,
+        workers * 2,
+    ):
         perspective_data = [
             course["course_id"],
             course["name"],
             perspective["uuid"],
             perspective["title"],
         ]
-        print(f"Collecting users insights for perspective {perspective['uuid']}")
-        users_csv = get_csv(
-            public_api_client,
-            f"perspectives/{perspective['uuid']}/insights/users",
-            parsed=True,
-        )
-        for row in users_csv:
-            csv_data.append(
+        summary_writer.writerow(perspective_data + summary)
+        with users_file:
+            users_writer.writerows(
                 perspective_data
                 + [
                     row["Name"],
@@ -105,13 +533,31 @@ def construct_user_insights(public_api_client, perspectives, course):
                     row["Role"],
                     row["Completion rate [%]"],
                 ]
+                for row in csv.DictReader(users_file)
             )
 
-    write_csv_file(
-        f"users-{public_api_client.subdomain}-{course['course_id']}.csv",
-        headers,
-        csv_data,
+
+def fetch_perspective_insights(public_api_client, perspective):
+    print(f"Collecting insights for perspective {perspective['uuid']}")
+    summary_csv = list(
+        get_csv(
+            public_api_client,
+            f"perspectives/{perspective['uuid']}/insights/overview",
+        )
+    )
+    summary = get_summary_values(summary_csv)
+    users_file = download_csv(
+        public_api_client, f"perspectives/{perspective['uuid']}/insights/users"
     )
+    return perspective, summary, users_file
+
+
+def get_summary_values(summary_csv):
+    return [
+        get_value_from_row(summary_csv[1], "Views", 0),
+        get_value_from_row(summary_csv[2], "Time Viewed [min]", 0),
+        get_value_from_row(summary_csv[3], "Unique Viewers", 0),
+    ]
 
 
 def get_value_from_row(row, name, default_value):
@@ -124,19 +570,61 @@ def get_value_from_row(row, name, default_value):
 
 
 def get_csv(public_api_client, url, parsed=False):
-    response = public_api_client.request("get", url)
-    content = response.content.decode("utf-8").splitlines()
-    if parsed:
-        return csv.DictReader(content)
-    return csv.reader(content)
-
-
-def write_csv_file(name, headers, data):
-    with open(name, "w") as csv_file:
-        print(f"Writing data to {os.path.realpath(csv_file.name)}")
-        csv_writer = csv.writer(csv_file)
-        csv_writer.writerow(headers)
-        csv_writer.writerows(data)
+    with public_api_client.request("get", url, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f"Could not get {url}: {response.text}")
+        content = stream_text(response)
+        if parsed:
+            yield from csv.DictReader(content)
+        else:
+            yield from csv.reader(content)
+
+
+def download_csv(public_api_client, url):
+    """
+    Streams a CSV response into a temporary file, which is returned rewound.
+    """
+    csv_file = tempfile.TemporaryFile("w+", encoding="utf-8", newline="")
+    with public_api_client.request("get", url, stream=True) as response:
+        if response.status_code != 200:
+            csv_file.close()
+            raise Exception(f"Could not get {url}: {response.text}")
+        shutil.copyfileobj(stream_text(response), csv_file)
+    csv_file.seek(0)
+    return csv_file
+
+
+def download_csv_if_changed(public_api_client, url, etag):
+    """
+    Like `download_csv`, but returns `(None, etag)` if the server says the CSV
+    hasn't changed since `etag`, and `(csv_file, new_etag)` otherwise.
+    """
+    headers = {"If-None-Match": etag} if etag else None
+    with public_api_client.request(
+        "get", url, stream=True, headers=headers
+    ) as response:
+        if response.status_code == 304:
+            return None, etag
+        if response.status_code != 200:
+            raise Exception(f"Could not get {url}: {response.text}")
+        csv_file = tempfile.TemporaryFile("w+", encoding="utf-8", newline="")
+        shutil.copyfileobj(stream_text(response), csv_file)
+    csv_file.seek(0)
+    return csv_file, response.headers.get("ETag")
+
+
+def output_file(name, suffix, format):
+    return output_path(f"{name}-{suffix}", format)
+
+
+def open_output(name, suffix, format, resume_from=None):
+    """
+    Opens the `summary` or `users` output, `<name>-<suffix>` with the
+    extension of the format.
+    """
+    path = output_file(name, suffix, format)
+    print(f"Writing data to {os.path.realpath(path)}")
+    return open_sink(format, path, name, OUTPUT_COLUMNS[name], resume_from)
 
 
 if __name__ == "__main__":
@@ -1,44 +1,81 @@
 import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
-from utils.utils import PublicAPIClient, get_commandline_arguments
+from utils.sinks import FLOAT, FORMATS, INTEGER, JSON, STRING, open_sink
+from utils.utils import (
+    PublicAPIClient,
+    get_commandline_arguments,
+    imap_ordered,
+    report_stats,
+)
 
 
 def main():
     args = get_commandline_arguments(
         [
-            (["media_id"], {"type": int, "help": "the media to get details about"}),
+            (
+                ["media_id"],
+                {"type": int, "nargs": "?", "help": "the media to get details about"},
+            ),
+            (
+                ["--batch"],
+                {
+                    "type": str,
+                    "help": "file with one media id per line ('-' for stdin), the details are printed as JSON lines",
+                },
+            ),
+            (
+                ["--workers"],
+                {
+                    "type": int,
+                    "default": 8,
+                    "help": "number of media to get details about in parallel in batch mode",
+                },
+            ),
+            (
+                ["--format"],
+                {
+                    "choices": FORMATS,
+                    "help": "write the batch results to --output in this format, one row per media (parquet needs pyarrow)",
+                },
+            ),
+            (
+                ["--output"],
+                {"type": str, "help": "output file of --format"},
+            ),
         ]
     )
+    if (args.media_id is None) == (args.batch is None):
+        sys.exit("Please specify either a media id or --batch")
+    if (args.format is None) != (args.output is None) or (
+        args.format and not args.batch
+    ):
+        sys.exit("--format and --output have to be used together, with --batch")
 
-    media_detailer = MediaDetailer(args.config, args.media_id)
-    media = media_detailer.get()
+    with PublicAPIClient(args.config) as public_api_client, report_stats(
+        public_api_client, args
+    ), ThreadPoolExecutor(
+        max_workers=(len(MediaDetailer.details) + 1) * args.workers
+    ) as detail_executor:
+        if args.batch:
+            if args.format:
+                with open_sink(
+                    args.format, args.output, "media_details", BATCH_COLUMNS
+                ) as sink:
+                    for result in get_batch_details(
+                        public_api_client, detail_executor, args.batch, args.workers
+                    ):
+                        sink.writerow(to_batch_row(result))
+            else:
+                for result in get_batch_details(
+                    public_api_client, detail_executor, args.batch, args.workers
+                ):
+                    print(json.dumps(result, sort_keys=True), flush=True)
+            return
 
-    captions = media_detailer.get("caption_files")
-    courses = media_detailer.get("courses")
-    tags = media_detailer.get("tags")
-    users = media_detailer.get("users", "user_permissions")
-
-    response = get_subdict(
-        media,
-        [
-            "id",
-            "title",
-            "description",
-            "duration",
-            "size",
-            "created_at",
-            "owner",
-            "collection",
-        ],
-    )
-    response.update(
-        {
-            "captions": captions,
-            "courses": courses,
-            "tags": tags,
-            "users": users,
-        }
-    )
+        media_detailer = MediaDetailer(public_api_client, args.media_id)
+        response = media_detailer.get_details(detail_executor)
 
     print(
         json.dumps(
@@ -49,11 +86,82 @@ def main():
     )
 
 
+def get_batch_details(public_api_client, detail_executor, batch_file, workers):
+    """
+    Yields the details of the media listed in `batch_file`, in the order of
+    the file. Media that can't be fetched get an error result.
+    """
+
+    def get_details(media_id):
+        # the id is kept as it's listed, it doesn't have to be numeric
+        try:
+            details = MediaDetailer(public_api_client, media_id).get_details(
+                detail_executor
+            )
+        except Exception as e:
+            return {"media_id": media_id, "error": str(e)}
+        return {"media_id": media_id, "details": details}
+
+    with (sys.stdin if batch_file == "-" else open(batch_file)) as f:
+        media_ids = (line.strip() for line in f if line.strip())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from imap_ordered(executor, get_details, media_ids, workers * 2)
+
+
+MEDIA_ATTRIBUTES = [
+    ("id", INTEGER),
+    ("title", STRING),
+    ("description", STRING),
+    ("duration", FLOAT),
+    ("size", INTEGER),
+    ("created_at", STRING),
+    ("owner", JSON),
+    ("collection", JSON),
+]
+
+# the details of the media are lists of objects, kept as JSON columns
+BATCH_COLUMNS = (
+    [("media_id", STRING), ("error", STRING)]
+    + MEDIA_ATTRIBUTES
+    + [("captions", JSON), ("courses", JSON), ("tags", JSON), ("users", JSON)]
+)
+
+
+def to_batch_row(result):
+    details = result.get("details", {})
+    return [result["media_id"], result.get("error")] + [
+        details.get(name) for name, _ in BATCH_COLUMNS[2:]
+    ]
+
+
 class MediaDetailer:
-    def __init__(self, config, media_id):
-        self.public_api_client = PublicAPIClient(config)
+    # detail_url, detail_attribute of the media details besides the media itself
+    details = {
+        "captions": ("caption_files", None),
+        "courses": ("courses", None),
+        "tags": ("tags", None),
+        "users": ("users", "user_permissions"),
+    }
+
+    def __init__(self, public_api_client, media_id):
+        self.public_api_client = public_api_client
         self.media_id = media_id
 
+    def get_details(self, executor):
+        """
+        Collects the media and its details, the requests run in parallel on
+        `executor`.
+        """
+        media = executor.submit(self.get)
+        details = {
+            name: executor.submit(self.get, detail_url, detail_attribute)
+            for name, (detail_url, detail_attribute) in self.details.items()
+        }
+
+        response = get_subdict(media.result(), [name for name, _ in MEDIA_ATTRIBUTES])
+        response.update({name: future.result() for name, future in details.items()})
+        return response
+
     def get(self, detail_url=None, detail_attribute=None):
         if detail_url:
             url = f"media/{self.media_id}/{detail_url}"
@@ -1,12 +1,14 @@
-from utils.utils import PublicAPIClient, get_commandline_arguments
+from utils.utils import PublicAPIClient, get_commandline_arguments, report_stats
 
 
 def main():
     args = get_commandline_arguments()
 
-    public_api_client = PublicAPIClient(args.config)
-    public_api_client.refresh_tokens()
-    response = public_api_client.request("get", "ping")
+    with PublicAPIClient(args.config) as public_api_client, report_stats(
+        public_api_client, args
+    ):
+        public_api_client.refresh_tokens()
+        response = public_api_client.request("get", "ping")
 
     if response.status_code == 200 and response.text == "pong":
         print("You have successfully configured your public API access.")
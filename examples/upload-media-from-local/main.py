@@ -1,26 +1,481 @@
 import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-from utils.utils import PublicAPIClient, request_with_retry, get_commandline_arguments
+from upload_manifest import COMPLETED, CREATED, UPLOADED, UploadManifest
+from upload_pipeline import Pipeline
+from utils.rate_limit import TokenBucket
+from utils.upload import PresignedUrlExpired, upload_file
+from utils.utils import PublicAPIClient, get_commandline_arguments, report_stats
+
+
+# times a new upload URL is requested when the previous one has expired
+URL_RENEWALS = 2
+# seconds before a file of the watched directory that failed is tried again
+WATCH_RETRY_DELAY = 300
+# files of the watched directory that are still being written elsewhere
+PARTIAL_SUFFIXES = (".part", ".tmp", ".crdownload")
 
 
 def main():
     args = get_commandline_arguments(
         [
-            (["files"], {"nargs": "+", "help": "path to the media file(s)"}),
+            (["files"], {"nargs": "*", "help": "path to the media file(s)"}),
             (["--collection-id"], {"type": int, "help": "upload into a collection"}),
             (["--user-id"], {"type": int, "help": "upload on behalf of a user"}),
+            (
+                ["--workers"],
+                {
+                    "type": int,
+                    "default": 4,
+                    "help": "number of files to upload in parallel",
+                },
+            ),
+            (
+                ["--watch"],
+                {
+                    "type": str,
+                    "metavar": "DIR",
+                    "help": "upload the files added to the directory, until interrupted (needs --manifest)",
+                },
+            ),
+            (
+                ["--poll-interval"],
+                {
+                    "type": float,
+                    "default": 5.0,
+                    "help": "seconds between scans of the --watch directory",
+                },
+            ),
+            (
+                ["--settle-time"],
+                {
+                    "type": float,
+                    "default": 30.0,
+                    "help": "seconds a file of the --watch directory has to be unmodified for before it's uploaded",
+                },
+            ),
+            (
+                ["--hash-workers"],
+                {
+                    "type": int,
+                    "default": 2,
+                    "help": "number of files to hash in parallel with --watch",
+                },
+            ),
+            (
+                ["--create-workers"],
+                {
+                    "type": int,
+                    "default": 2,
+                    "help": "number of media to create in parallel with --watch",
+                },
+            ),
+            (
+                ["--complete-workers"],
+                {
+                    "type": int,
+                    "default": 2,
+                    "help": "number of media to mark as uploaded in parallel with --watch",
+                },
+            ),
+            (
+                ["--queue-size"],
+                {
+                    "type": int,
+                    "default": 16,
+                    "help": "number of files waiting for each stage with --watch",
+                },
+            ),
+            (
+                ["--manifest"],
+                {
+                    "type": str,
+                    "help": "JSON lines file recording the uploaded files by content hash, files already in it are skipped or resumed",
+                },
+            ),
+            (
+                ["--max-bandwidth"],
+                {
+                    "type": float,
+                    "help": "limit the upload speed of all files together, in MB/s",
+                },
+            ),
         ]
     )
+    if args.watch and (args.files or not args.manifest):
+        sys.exit("--watch needs a --manifest, and no files")
+    if not args.watch and not args.files:
+        sys.exit("Please specify at least one file, or --watch")
+
+    bandwidth_limiter = None
+    if args.max_bandwidth:
+        bytes_per_second = args.max_bandwidth * 1024 * 1024
+        bandwidth_limiter = TokenBucket(bytes_per_second, burst=bytes_per_second)
+
+    manifest = UploadManifest(args.manifest) if args.manifest else None
+    if args.watch:
+        with PublicAPIClient(args.config) as public_api_client, report_stats(
+            public_api_client, args
+        ):
+            watch_directory(public_api_client, manifest, bandwidth_limiter, args)
+        return
+
+    with PublicAPIClient(args.config) as public_api_client, report_stats(
+        public_api_client, args
+    ), ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(
+            executor.map(
+                partial(
+                    upload_media,
+                    public_api_client,
+                    manifest,
+                    args.user_id,
+                    args.collection_id,
+                    bandwidth_limiter,
+                ),
+                args.files,
+            )
+        )
+
+    if manifest:
+        manifest.close()
 
-    public_api_client = PublicAPIClient(args.config)
-    for media_file in args.files:
-        media_filename = os.path.basename(media_file)
-        print(f"Uploading {media_filename}")
-        with open(media_file, "rb") as f:
-            media_id, presigned_url = create_media(public_api_client, args.user_id, args.collection_id)
-            upload_file(presigned_url, f)
+    print_summary(results)
+    if any(error for _, _, error, _ in results):
+        sys.exit(1)
+
+
+def upload_media(
+    public_api_client, manifest, user_id, collection_id, bandwidth_limiter, media_file
+):
+    """
+    Uploads one file, returns `(media_file, media_id, error, skipped)`.
+    Errors are returned instead of raised so a failing file doesn't stop the
+    others.
+
+    With a `manifest`, files whose content is already uploaded are skipped,
+    and unfinished uploads of the content are resumed.
+    """
+    media_filename = os.path.basename(media_file)
+    try:
+        if manifest is None:
+            print(f"Uploading {media_filename}")
+            media_id = upload_new_media(
+                public_api_client,
+                None,
+                None,
+                user_id,
+                collection_id,
+                bandwidth_limiter,
+                media_file,
+            )
             mark_media_as_uploaded(public_api_client, media_id, media_filename)
-        print(f"Uploaded {media_filename}")
+        else:
+            sha256 = manifest.content_hash(media_file)
+            with manifest.lock_content(sha256):
+                upload = manifest.get(sha256) or {"state": None}
+                if upload["state"] == COMPLETED:
+                    print(
+                        f"Skipping {media_filename}, it's uploaded as media {upload['media_id']}"
+                    )
+                    return media_file, upload["media_id"], None, True
+
+                media_id = upload.get("media_id")
+                if upload["state"] == CREATED:
+                    print(f"Resuming the upload of {media_filename}")
+                    media_id = resume_upload(
+                        public_api_client,
+                        manifest,
+                        sha256,
+                        upload,
+                        bandwidth_limiter,
+                        media_file,
+                    )
+                elif upload["state"] is None:
+                    print(f"Uploading {media_filename}")
+                if media_id is None:
+                    media_id = upload_new_media(
+                        public_api_client,
+                        manifest,
+                        sha256,
+                        user_id,
+                        collection_id,
+                        bandwidth_limiter,
+                        media_file,
+                    )
+                if upload["state"] == UPLOADED:
+                    print(f"Completing the upload of {media_filename}")
+                mark_media_as_uploaded(public_api_client, media_id, media_filename)
+                manifest.completed(sha256, media_id)
+    except Exception as e:
+        print(f"Could not upload {media_filename}: {e}")
+        return media_file, None, e, False
+    print(f"Uploaded {media_filename}")
+    return media_file, media_id, None, False
+
+
+def resume_upload(
+    public_api_client, manifest, sha256, upload, bandwidth_limiter, media_file
+):
+    """
+    Uploads the file to the URL of the media created by an earlier run.
+    Returns the media id, or None if the URL has expired.
+    """
+    try:
+        upload_file(
+            public_api_client,
+            upload["url"],
+            media_file,
+            progress=progress_reporter(os.path.basename(media_file)),
+            bandwidth_limiter=bandwidth_limiter,
+        )
+    except PresignedUrlExpired:
+        print(
+            f"The upload URL of {os.path.basename(media_file)} expired, requesting a new one"
+        )
+        return None
+    manifest.uploaded(sha256, upload["media_id"])
+    return upload["media_id"]
+
+
+def upload_new_media(
+    public_api_client,
+    manifest,
+    sha256,
+    user_id,
+    collection_id,
+    bandwidth_limiter,
+    media_file,
+):
+    """
+    Creates a media and uploads the file to it, returns the media id. If the
+    upload URL expires, e.g. while the file waited for a retry, the media is
+    created again with a new one.
+    """
+    media_filename = os.path.basename(media_file)
+    for renewal in range(URL_RENEWALS + 1):
+        media_id, presigned_url = create_media(
+            public_api_client, user_id, collection_id
+        )
+        if manifest:
+            manifest.created(sha256, media_file, media_id, presigned_url)
+        try:
+            upload_file(
+                public_api_client,
+                presigned_url,
+                media_file,
+                progress=progress_reporter(media_filename),
+                bandwidth_limiter=bandwidth_limiter,
+            )
+            break
+        except PresignedUrlExpired:
+            if renewal == URL_RENEWALS:
+                raise
+            print(f"The upload URL of {media_filename} expired, requesting a new one")
+    if manifest:
+        manifest.uploaded(sha256, media_id)
+    return media_id
+
+
+def watch_directory(public_api_client, manifest, bandwidth_limiter, args):
+    """
+    Uploads the files added to the `--watch` directory until interrupted.
+    Files are uploaded once they haven't been modified for `--settle-time`
+    seconds, through the stages hash -> create -> upload -> complete. Each
+    stage has its own workers and a bounded queue, so e.g. hashing stops
+    while the uploads can't keep up.
+
+    The progress of every file is kept in the manifest, so after a restart
+    the files already uploaded are skipped, and the others continue from
+    the stage they reached.
+    """
+    # files in the pipeline or uploaded, by path: (size, mtime_ns)
+    submitted = {}
+    # files that failed, by path: when to try them again
+    retry_at = {}
+    # contents in the pipeline: the path of the file uploading them, so
+    # copies of a file are only uploaded once
+    in_progress = {}
+    lock = threading.Lock()
+
+    def hash_stage(job):
+        job["sha256"] = manifest.content_hash(job["path"])
+        upload = manifest.get(job["sha256"]) or {"state": None}
+        with lock:
+            if upload["state"] == COMPLETED:
+                job["skipped"] = True
+                job["media_id"] = upload["media_id"]
+                return None
+            if job["sha256"] in in_progress:
+                job["deferred"] = True
+                return None
+            in_progress[job["sha256"]] = job["path"]
+        job["upload"] = upload
+        if upload["state"] == CREATED:
+            print(f"Resuming the upload of {job['filename']}")
+            return "upload"
+        if upload["state"] == UPLOADED:
+            job["media_id"] = upload["media_id"]
+            return "complete"
+        print(f"Uploading {job['filename']}")
+        return "create"
+
+    def create_stage(job):
+        media_id, presigned_url = create_media(
+            public_api_client, args.user_id, args.collection_id
+        )
+        manifest.created(job["sha256"], job["path"], media_id, presigned_url)
+        job["upload"] = {"media_id": media_id, "url": presigned_url}
+        return "upload"
+
+    def upload_stage(job):
+        # uploads to a new media itself if the URL has expired, stages only
+        # send jobs forward
+        job["media_id"] = resume_upload(
+            public_api_client,
+            manifest,
+            job["sha256"],
+            job["upload"],
+            bandwidth_limiter,
+            job["path"],
+        ) or upload_new_media(
+            public_api_client,
+            manifest,
+            job["sha256"],
+            args.user_id,
+            args.collection_id,
+            bandwidth_limiter,
+            job["path"],
+        )
+        return "complete"
+
+    def complete_stage(job):
+        mark_media_as_uploaded(public_api_client, job["media_id"], job["filename"])
+        manifest.completed(job["sha256"], job["media_id"])
+        return None
+
+    def release(job):
+        # called with the lock held
+        if in_progress.get(job.get("sha256")) == job["path"]:
+            del in_progress[job["sha256"]]
+
+    def on_done(job):
+        with lock:
+            release(job)
+            if job.get("deferred"):
+                # a copy of a file in progress, it's checked again by the next scan
+                del submitted[job["path"]]
+                return
+        if job.get("skipped"):
+            print(
+                f"Skipping {job['filename']}, it's uploaded as media {job['media_id']}"
+            )
+        else:
+            print(f"Uploaded {job['filename']} (media id: {job['media_id']})")
+
+    def on_error(job, error):
+        print(f"Could not upload {job['filename']}, trying again later: {error}")
+        with lock:
+            release(job)
+            del submitted[job["path"]]
+            retry_at[job["path"]] = time.monotonic() + WATCH_RETRY_DELAY
+
+    pipeline = Pipeline(
+        [
+            ("hash", hash_stage, args.hash_workers),
+            ("create", create_stage, args.create_workers),
+            ("upload", upload_stage, args.workers),
+            ("complete", complete_stage, args.complete_workers),
+        ],
+        args.queue_size,
+        on_done,
+        on_error,
+    )
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Watching {args.watch}")
+    try:
+        while True:
+            for path, size, mtime_ns in find_settled_files(
+                args.watch, args.settle_time
+            ):
+                with lock:
+                    if submitted.get(path) == (size, mtime_ns):
+                        continue
+                    if retry_at.get(path, 0) > time.monotonic():
+                        continue
+                    submitted[path] = (size, mtime_ns)
+                    retry_at.pop(path, None)
+                # waits while the hash stage is full
+                pipeline.submit(
+                    {"path": path, "filename": os.path.basename(path)}, "hash"
+                )
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopped watching, unfinished uploads continue with the next run")
+
+
+def find_settled_files(directory, settle_time):
+    """
+    Yields `(path, size, mtime_ns)` of the files in the directory which
+    haven't been modified for `settle_time` seconds, i.e. are probably fully
+    written. Hidden and partial files are ignored.
+    """
+    now = time.time_ns()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or entry.name.endswith(PARTIAL_SUFFIXES):
+                continue
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime_ns >= settle_time * 1e9:
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def progress_reporter(media_filename):
+    """
+    Returns a progress callback printing the progress of the file at every
+    10%. A retried upload starts again from 0%.
+    """
+    reported = 0
+
+    def report_progress(uploaded, total, bytes_per_second):
+        nonlocal reported
+        percent = uploaded * 100 // total if total else 100
+        if percent < reported:
+            reported = 0
+        if percent >= reported + 10:
+            reported = percent - percent % 10
+            print(
+                f"{media_filename}: {percent}% of {total} bytes, "
+                f"{bytes_per_second / 1024 / 1024:.1f} MB/s"
+            )
+
+    return report_progress
+
+
+def print_summary(results):
+    failed = [result for result in results if result[2]]
+    skipped = [result for result in results if result[3]]
+    print(
+        f"\nUploaded {len(results) - len(failed) - len(skipped)} of {len(results)} files"
+        + (f", skipped {len(skipped)} already uploaded" if skipped else "")
+    )
+    for media_file, media_id, error, skipped in results:
+        if error:
+            print(f"  FAILED    {media_file}: {error}")
+        elif skipped:
+            print(f"  SKIPPED   {media_file} (media id: {media_id})")
+        else:
+            print(f"  UPLOADED  {media_file} (media id: {media_id})")
 
 
 def create_media(public_api_client, user_id, collection_id):
@@ -44,16 +499,6 @@ def create_media(public_api_client, user_id, collection_id):
     )
 
 
-def upload_file(presigned_url, f):
-    response = request_with_retry(
-        "put",
-        presigned_url,
-        data=f,
-    )
-    if response.status_code != 200:
-        raise Exception(f"Could not upload file: {response.text}")
-
-
 def mark_media_as_uploaded(public_api_client, media_id, media_filename):
     response = public_api_client.request(
         "post", f"media/uploads/{media_id}/complete", params={"title": media_filename}
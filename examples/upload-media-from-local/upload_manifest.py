@@ -0,0 +1,134 @@
+import collections
+import json
+import os
+import threading
+
+from utils.utils import file_sha256
+
+# states of an upload, in order
+CREATED = "created"
+UPLOADED = "uploaded"
+COMPLETED = "completed"
+
+
+class UploadManifest:
+    """
+    Records the uploads of files by their content hash in a JSON lines file,
+    so a rerun can skip the completed ones and resume the rest. Records are
+    only appended, every state change of an upload adds one:
+
+        {"sha256": "...", "state": "created", "media_id": 12, "url": "...", "path": "...", "size": 1024, "mtime_ns": ...}
+        {"sha256": "...", "state": "uploaded", "media_id": 12}
+        {"sha256": "...", "state": "completed", "media_id": 12}
+
+    The size and modification time of the files are recorded too, so files
+    which haven't changed since they were hashed don't have to be read again.
+    Thread safe.
+    """
+
+    def __init__(self, path):
+        self.uploads = {}
+        # (path, size, mtime_ns) -> content hash, of the recorded files and
+        # the ones hashed by this process
+        self.hashes = {}
+        self.lock = threading.Lock()
+        self.content_locks = collections.defaultdict(threading.Lock)
+        complete = True
+        if os.path.exists(path):
+            complete = self._load(path)
+        self.file = open(path, "a")
+        if not complete:
+            self.file.write("\n")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def content_hash(self, path):
+        """
+        Returns the SHA-256 hash of the file's content. It's only computed if
+        the file has changed since it was recorded or hashed before.
+        """
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if key in self.hashes:
+                return self.hashes[key]
+        sha256 = file_sha256(path)
+        with self.lock:
+            self.hashes[key] = sha256
+        return sha256
+
+    def get(self, sha256):
+        """
+        Returns the recorded upload of the content (a dict with its `state`
+        and `media_id`), or None.
+        """
+        with self.lock:
+            upload = self.uploads.get(sha256)
+            return dict(upload) if upload else None
+
+    def lock_content(self, sha256):
+        """
+        Returns a lock for the content, so identical files uploaded in
+        parallel are only uploaded once.
+        """
+        with self.lock:
+            return self.content_locks[sha256]
+
+    def created(self, sha256, path, media_id, url):
+        stat = os.stat(path)
+        self._append(
+            {
+                "sha256": sha256,
+                "state": CREATED,
+                "media_id": media_id,
+                "url": url,
+                "path": os.path.abspath(path),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+        )
+
+    def uploaded(self, sha256, media_id):
+        self._append({"sha256": sha256, "state": UPLOADED, "media_id": media_id})
+
+    def completed(self, sha256, media_id):
+        self._append({"sha256": sha256, "state": COMPLETED, "media_id": media_id})
+
+    def _append(self, record):
+        with self.lock:
+            self._apply(record)
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def _apply(self, record):
+        upload = self.uploads.setdefault(record["sha256"], {})
+        if record["state"] == CREATED:
+            # a new media for the content, e.g. after its upload URL expired
+            upload.clear()
+            self.hashes[(record["path"], record["size"], record["mtime_ns"])] = record[
+                "sha256"
+            ]
+        upload.update(record)
+
+    def _load(self, path):
+        """
+        Reads the records, returns False if the last one is cut off, which
+        happens if a run was killed while writing it.
+        """
+        line = "\n"
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self._apply(record)
+        return line.endswith("\n")
@@ -0,0 +1,49 @@
+import queue
+import threading
+
+
+class Pipeline:
+    """
+    Runs jobs through stages, each with its own worker threads and a queue
+    of at most `queue_size` jobs. A stage is a function taking the job (a
+    dict) and returning the name of the stage to send it to next, or None
+    when the job is done. Stages can only send jobs forward, so a full queue
+    blocks the workers of the stage before it, and in the end `submit()`,
+    instead of piling up jobs in memory.
+
+    `stages` is a list of `(name, function, workers)` in order. `on_done`
+    and `on_error` are called from the workers with the job, and the
+    exception for `on_error`.
+    """
+
+    def __init__(self, stages, queue_size, on_done, on_error):
+        self.functions = {}
+        self.queues = {}
+        self.on_done = on_done
+        self.on_error = on_error
+        for name, function, workers in stages:
+            self.functions[name] = function
+            self.queues[name] = queue.Queue(maxsize=queue_size)
+            for _ in range(workers):
+                # the jobs are persisted by the stages, unfinished ones are
+                # resumed by the next run, so the workers don't block exiting
+                threading.Thread(target=self._work, args=(name,), daemon=True).start()
+
+    def submit(self, job, stage):
+        """
+        Queues the job for the stage, waits while its queue is full.
+        """
+        self.queues[stage].put(job)
+
+    def _work(self, stage):
+        while True:
+            job = self.queues[stage].get()
+            try:
+                next_stage = self.functions[stage](job)
+            except Exception as e:
+                self.on_error(job, e)
+            else:
+                if next_stage:
+                    self.queues[next_stage].put(job)
+                else:
+                    self.on_done(job)
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from utils.async_utils import ASYNC_RETRY_EXCEPTIONS, AsyncPublicAPIClient
+
+
+def write_config(tmp_path, **extra):
+    config = {
+        "access_token": "access-token",
+        "client_id": "client-id",
+        "client_secret": "client-secret",
+        "refresh_token": "refresh-token",
+        "subdomain": "tw",
+    }
+    config.update(extra)
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config))
+    return str(path)
+
+
+def test_client_retries_async_exceptions(tmp_path):
+    client = AsyncPublicAPIClient(write_config(tmp_path))
+    assert client.retry_policy.exceptions == ASYNC_RETRY_EXCEPTIONS
+
+
+def test_client_uses_retry_config(tmp_path):
+    client = AsyncPublicAPIClient(
+        write_config(tmp_path, retry={"retries": 5, "deadline": 600})
+    )
+    assert client.retry_policy.retries == 5
+    assert client.retry_policy.deadline == 600
+    assert client.retry_policy.exceptions == ASYNC_RETRY_EXCEPTIONS
+
+
+def test_client_rejects_exceptions_in_retry_config(tmp_path):
+    with pytest.raises(Exception, match="Unknown retry settings"):
+        AsyncPublicAPIClient(
+            write_config(tmp_path, retry={"exceptions": ["TimeoutError"]})
+        )
@@ -0,0 +1,96 @@
+import hashlib
+import socket
+import tempfile
+import threading
+
+import pytest
+import requests
+
+from utils.utils import RetryPolicy, file_sha256, request_with_retry
+
+
+def start_server(handle):
+    """
+    Accepts connections on a local port and calls `handle` with each of
+    them, returns the URL and the list of the requests received.
+    """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    received = []
+
+    def serve():
+        while True:
+            connection, _ = server.accept()
+            received.append(connection.recv(65536))
+            handle(connection)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return f"http://127.0.0.1:{server.getsockname()[1]}/", received
+
+
+def hang(connection):
+    threading.Timer(2, connection.close).start()
+
+
+def closed_port_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/"
+
+
+POLICY = RetryPolicy(retries=2, backoff_factor=0)
+
+
+def test_get_is_retried_after_read_timeout():
+    url, received = start_server(hang)
+    with pytest.raises(requests.ReadTimeout):
+        request_with_retry("get", url, retry_policy=POLICY, timeout=(1, 0.2))
+    assert len(received) == 3
+
+
+def test_post_is_not_retried_after_read_timeout():
+    url, received = start_server(hang)
+    with pytest.raises(requests.ReadTimeout):
+        request_with_retry("post", url, retry_policy=POLICY, timeout=(1, 0.2))
+    assert len(received) == 1
+
+
+def test_post_is_not_retried_after_disconnect():
+    url, received = start_server(lambda connection: connection.close())
+    with pytest.raises(requests.ConnectionError):
+        request_with_retry("post", url, retry_policy=POLICY)
+    assert len(received) == 1
+
+
+class AttemptCounter:
+    # a rate limiter that never waits, counting the attempts
+    def __init__(self):
+        self.attempts = 0
+
+    def reserve(self):
+        self.attempts += 1
+        return 0
+
+
+def test_post_is_retried_if_it_could_not_connect():
+    counter = AttemptCounter()
+    with pytest.raises(requests.ConnectionError):
+        request_with_retry(
+            "post", closed_port_url(), retry_policy=POLICY, rate_limiter=counter
+        )
+    assert counter.attempts == 3
+
+
+def test_file_sha256_of_path(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"x" * (5 * 1024 * 1024))
+    assert file_sha256(str(path)) == hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def test_file_sha256_of_text_file_is_the_hash_of_its_text():
+    text = "Name,Email\r\nJosé,jose@example.com\r\n"
+    with tempfile.TemporaryFile("w+", encoding="utf-8", newline="") as f:
+        f.write(text)
+        f.seek(0)
+        assert file_sha256(f.fileno()) == hashlib.sha256(text.encode()).hexdigest()
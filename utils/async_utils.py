@@ -0,0 +1,212 @@
+import asyncio
+import json
+
+import aiohttp
+
+from utils.utils import (
+    DEFAULT_CONFIG_FILE,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT,
+    CACHE_DIR,
+    IDEMPOTENT_METHODS,
+    BaseAPIClient,
+    RetryPolicy,
+)
+from utils.rate_limit import get_rate_limiter
+
+
+DEFAULT_MAX_CONCURRENCY = 100
+ASYNC_RETRY_EXCEPTIONS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+
+class AsyncPublicAPIClient(BaseAPIClient):
+    """
+    asyncio version of `PublicAPIClient`, it has to be used from a running
+    event loop:
+
+        async with AsyncPublicAPIClient(args.config) as public_api_client:
+            response = await public_api_client.request("get", "ping")
+
+    At most `max_concurrency` requests (set in the config file) are in flight
+    at the same time, the rest wait for a free slot.
+    """
+
+    def __init__(self, config_file=DEFAULT_CONFIG_FILE, max_concurrency=None):
+        super().__init__(config_file)
+        self.max_concurrency = max_concurrency or self.config.get(
+            "max_concurrency", DEFAULT_MAX_CONCURRENCY
+        )
+        self.retry_policy = RetryPolicy.from_config(
+            self.config.get("retry", {}), exceptions=ASYNC_RETRY_EXCEPTIONS
+        )
+        self.rate_limiter = get_rate_limiter(self, CACHE_DIR)
+        self.refresh_lock = None
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, url, params=None, data=None, version_prefix="v1/"):
+        session = self._get_session()
+        access_token = self.config["access_token"]
+        if self._token_expires_soon():
+            await self.refresh_tokens(stale_access_token=access_token)
+            access_token = self.config["access_token"]
+
+        async with self.semaphore:
+            response = await async_request_with_retry(
+                session,
+                method,
+                self._api_url(url, version_prefix),
+                headers=self._authorization_headers(access_token),
+                params=params,
+                data=data,
+                retry_policy=self.retry_policy,
+                rate_limiter=self.rate_limiter,
+            )
+        if response.status_code == 401:
+            await self.refresh_tokens(stale_access_token=access_token)
+            response = await self.request(
+                method, url, params=params, data=data, version_prefix=version_prefix
+            )
+        return response
+
+    async def refresh_tokens(self, stale_access_token=None):
+        """
+        Like `PublicAPIClient.refresh_tokens`: one task refreshes the tokens,
+        the others wait for it and use the new ones.
+        """
+        session = self._get_session()
+        async with self.refresh_lock:
+            # waiting for another process to finish its refresh blocks the
+            # event loop, but only for the duration of one token request
+            with self._config_file_lock():
+                if not self._needs_refresh(stale_access_token):
+                    return
+                response = await async_request_with_retry(
+                    session,
+                    "post",
+                    self._api_url("oauth/token", version_prefix=""),
+                    data=self._refresh_tokens_data(),
+                    retry_policy=self.retry_policy,
+                    rate_limiter=self.rate_limiter,
+                )
+                if response.status_code != 200:
+                    raise Exception(f"Could not refresh tokens: {response.text}")
+                self._update_tokens(response.json())
+
+    def _get_session(self):
+        # aiohttp sessions have to be created inside the running event loop
+        if self.session is None:
+            self.refresh_lock = asyncio.Lock()
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency,
+                    limit_per_host=self.config.get(
+                        "pool_maxsize", DEFAULT_POOL_MAXSIZE
+                    ),
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=self.config.get(
+                        "connect_timeout", DEFAULT_CONNECT_TIMEOUT
+                    ),
+                    sock_read=self.config.get("read_timeout", DEFAULT_READ_TIMEOUT),
+                ),
+            )
+        return self.session
+
+
+class AsyncResponse:
+    """
+    The parts of `requests.Response` the examples use, with the body already
+    read so it can be used after the connection is released.
+    """
+
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+async def async_request_with_retry(
+    session,
+    method,
+    url,
+    headers=None,
+    params=None,
+    data=None,
+    retry=3,
+    retry_policy=None,
+    rate_limiter=None,
+):
+    retry_policy = retry_policy or RetryPolicy(
+        retries=retry, exceptions=ASYNC_RETRY_EXCEPTIONS
+    )
+    deadline = retry_policy.start_deadline()
+    attempt = 0
+    while True:
+        if rate_limiter:
+            await asyncio.sleep(rate_limiter.reserve())
+        try:
+            async with session.request(
+                method.upper(),
+                url,
+                headers=headers,
+                params=_clean_params(params),
+                data=data,
+            ) as response:
+                content = await response.read()
+        except retry_policy.exceptions as e:
+            delay = retry_policy.backoff(attempt)
+            if not retry_policy.can_retry(attempt, delay, deadline):
+                raise
+            # only a failed connection means the request wasn't sent
+            if method.lower() not in IDEMPOTENT_METHODS and not isinstance(
+                e, aiohttp.ClientConnectorError
+            ):
+                raise
+        else:
+            response = AsyncResponse(
+                response.status, response.headers, content, str(response.url)
+            )
+            if response.status_code not in retry_policy.status_codes:
+                return response
+            delay = retry_policy.backoff(attempt, response)
+            if not retry_policy.can_retry(attempt, delay, deadline):
+                return response
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def _clean_params(params):
+    # requests drops None values and accepts booleans, aiohttp does neither
+    if not params:
+        return None
+    return {
+        key: str(value) if isinstance(value, bool) else value
+        for key, value in params.items()
+        if value is not None
+    }
@@ -0,0 +1,228 @@
+import collections
+import fnmatch
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+DEFAULT_TTL = 300
+DEFAULT_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    Caches the responses of GET requests, in memory and optionally on disk.
+
+    Responses are used without a request for `ttl` seconds, or for the TTL of
+    the first pattern in `ttls` matching the URL (e.g. `{"media/*": 60}`).
+    After that, responses with an ETag or Last-Modified header are
+    revalidated with a conditional request. Both tiers evict the least
+    recently used responses when they grow over their size limit.
+    """
+
+    def __init__(
+        self,
+        ttl=DEFAULT_TTL,
+        ttls=None,
+        memory_max_bytes=DEFAULT_MEMORY_MAX_BYTES,
+        disk_dir=None,
+        disk_max_bytes=DEFAULT_DISK_MAX_BYTES,
+    ):
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.memory = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.memory_max_bytes = memory_max_bytes
+        self.disk = DiskCache(disk_dir, disk_max_bytes) if disk_dir else None
+        self.stats = collections.Counter()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cache_config, disk_dir):
+        """
+        Creates the cache from the `cache` object of the config file, the
+        disk tier is used if it has `"disk": true`.
+        """
+        return cls(
+            ttl=cache_config.get("ttl", DEFAULT_TTL),
+            ttls=cache_config.get("ttls"),
+            memory_max_bytes=cache_config.get(
+                "memory_max_bytes", DEFAULT_MEMORY_MAX_BYTES
+            ),
+            disk_dir=disk_dir if cache_config.get("disk", False) else None,
+            disk_max_bytes=cache_config.get("disk_max_bytes", DEFAULT_DISK_MAX_BYTES),
+        )
+
+    def request(self, url, params, send, version_prefix=""):
+        """
+        Returns the response for `url` and `params` from the cache, or by
+        calling `send(headers)` with the conditional headers to use. The
+        `version_prefix` of the API is part of the cache key, but the `ttls`
+        patterns are matched against the URL without it.
+        """
+        key = _cache_key(f"{version_prefix}{url}", params)
+        entry = self._get(key)
+        if entry and entry["expires_at"] > time.time():
+            self._count(hits=1, bytes_saved=len(entry["content"]))
+            return _to_response(entry)
+
+        headers = {}
+        if entry and entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry and entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+
+        response = send(headers)
+        if response.status_code == 304 and entry:
+            self._count(revalidated=1, bytes_saved=len(entry["content"]))
+            entry["expires_at"] = time.time() + self._ttl_for(url)
+            self._put(key, entry)
+            return _to_response(entry)
+
+        self._count(misses=1)
+        if response.status_code == 200:
+            self._put(
+                key,
+                {
+                    "url": response.url,
+                    "status_code": response.status_code,
+                    "headers": dict(response.headers),
+                    "content": response.content,
+                    "expires_at": time.time() + self._ttl_for(url),
+                },
+            )
+        return response
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def _count(self, **counts):
+        with self.lock:
+            self.stats.update(counts)
+
+    def _ttl_for(self, url):
+        for pattern, ttl in self.ttls.items():
+            if fnmatch.fnmatch(url.lstrip("/"), pattern):
+                return ttl
+        return self.ttl
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry:
+                self.memory.move_to_end(key)
+                return entry
+        if self.disk:
+            entry = self.disk.get(key)
+            if entry:
+                self._put_in_memory(key, entry)
+            return entry
+        return None
+
+    def _put(self, key, entry):
+        self._put_in_memory(key, entry)
+        if self.disk:
+            self._count(disk_evictions=self.disk.put(key, entry))
+
+    def _put_in_memory(self, key, entry):
+        size = len(entry["content"])
+        if size > self.memory_max_bytes:
+            return
+        with self.lock:
+            previous = self.memory.pop(key, None)
+            if previous:
+                self.memory_bytes -= len(previous["content"])
+            self.memory[key] = entry
+            self.memory_bytes += size
+            while self.memory_bytes > self.memory_max_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= len(evicted["content"])
+                self.stats["memory_evictions"] += 1
+
+
+class DiskCache:
+    """
+    One file per response in `path`: a line of JSON metadata followed by the
+    body. The modification time of the files is used as their last access
+    time for the eviction.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.size = sum(file.stat().st_size for file in self._files())
+
+    def get(self, key):
+        file_path = os.path.join(self.path, key)
+        try:
+            with open(file_path, "rb") as f:
+                entry = json.loads(f.readline())
+                entry["content"] = f.read()
+            os.utime(file_path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        """
+        Stores the entry, returns the number of evicted entries.
+        """
+        metadata = {name: value for name, value in entry.items() if name != "content"}
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps(metadata).encode() + b"\n")
+            f.write(entry["content"])
+        file_path = os.path.join(self.path, key)
+        with self.lock:
+            if os.path.exists(file_path):
+                self.size -= os.path.getsize(file_path)
+            os.replace(temp_path, file_path)
+            self.size += os.path.getsize(file_path)
+            if self.size > self.max_bytes:
+                return self._evict()
+        return 0
+
+    def _evict(self):
+        evicted = 0
+        files = sorted(self._files(), key=lambda file: file.stat().st_mtime)
+        for file in files:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = file.stat().st_size
+                os.remove(file.path)
+            except OSError:
+                continue
+            self.size -= size
+            evicted += 1
+        return evicted
+
+    def _files(self):
+        # files starting with "." are being written
+        return [file for file in os.scandir(self.path) if not file.name.startswith(".")]
+
+
+def _cache_key(url, params):
+    key = json.dumps([url, sorted((params or {}).items())], default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _to_response(entry):
+    response = requests.Response()
+    response.status_code = entry["status_code"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response._content = entry["content"]
+    response.url = entry["url"]
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.reason = "OK"
+    return response
@@ -0,0 +1,247 @@
+import bisect
+import collections
+import json
+import re
+import threading
+import urllib.parse
+
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    float("inf"),
+]
+
+
+class LatencyHistogram:
+    """
+    Counts latencies in `LATENCY_BUCKETS`, so its size doesn't depend on the
+    number of requests. Percentiles are the upper bound of their bucket.
+    """
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        threshold = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= threshold and count:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count else 0.0,
+            "max_seconds": self.max,
+            "p50_seconds": self.percentile(0.5),
+            "p95_seconds": self.percentile(0.95),
+            "p99_seconds": self.percentile(0.99),
+            "buckets": {
+                str(bound): count
+                for bound, count in zip(LATENCY_BUCKETS, self.counts)
+                if count
+            },
+        }
+
+
+class Metrics:
+    """
+    Collects what the requests of a client did: latency histograms per
+    endpoint, status codes, errors, retries and the time slept before them,
+    the time spent waiting for the rate limiter, token refreshes and the
+    bytes sent and received. Thread safe.
+
+    Functions added with `add_hook` are called with a dict describing every
+    attempt (`method`, `endpoint`, `url`, `status_code`, `error`,
+    `elapsed`, `bytes_in`, `bytes_out`), e.g. to log slow requests.
+    """
+
+    def __init__(self):
+        self.endpoints = collections.defaultdict(LatencyHistogram)
+        self.counters = collections.Counter()
+        self.status_codes = collections.Counter()
+        self.errors = collections.Counter()
+        self.hooks = []
+        self.lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record_attempt(
+        self,
+        method,
+        url,
+        elapsed,
+        status_code=None,
+        error=None,
+        bytes_in=0,
+        bytes_out=0,
+    ):
+        endpoint = endpoint_name(method, url)
+        with self.lock:
+            self.endpoints[endpoint].add(elapsed)
+            self.counters["requests"] += 1
+            self.counters["bytes_in"] += bytes_in
+            self.counters["bytes_out"] += bytes_out
+            if status_code is not None:
+                self.status_codes[status_code] += 1
+            if error is not None:
+                self.errors[error] += 1
+        for hook in self.hooks:
+            hook(
+                {
+                    "method": method.upper(),
+                    "endpoint": endpoint,
+                    "url": url,
+                    "status_code": status_code,
+                    "error": error,
+                    "elapsed": elapsed,
+                    "bytes_in": bytes_in,
+                    "bytes_out": bytes_out,
+                }
+            )
+
+    def record_retry(self, delay):
+        with self.lock:
+            self.counters["retries"] += 1
+            self.counters["backoff_seconds"] += delay
+
+    def record_rate_limit_wait(self, seconds):
+        with self.lock:
+            self.counters["rate_limit_wait_seconds"] += seconds
+
+    def record_refresh(self):
+        with self.lock:
+            self.counters["token_refreshes"] += 1
+
+    def summary(self, extra=None):
+        """
+        Returns the metrics as a JSON serializable dict, with the `extra`
+        sections (e.g. the stats of the response cache) added to it.
+        """
+        with self.lock:
+            summary = {
+                "requests": self.counters["requests"],
+                "retries": self.counters["retries"],
+                "backoff_seconds": self.counters["backoff_seconds"],
+                "rate_limit_wait_seconds": self.counters["rate_limit_wait_seconds"],
+                "token_refreshes": self.counters["token_refreshes"],
+                "bytes_in": self.counters["bytes_in"],
+                "bytes_out": self.counters["bytes_out"],
+                "status_codes": {
+                    str(status_code): count
+                    for status_code, count in sorted(self.status_codes.items())
+                },
+                "errors": dict(self.errors),
+                "endpoints": {
+                    endpoint: histogram.summary()
+                    for endpoint, histogram in sorted(self.endpoints.items())
+                },
+            }
+        summary.update(extra or {})
+        return summary
+
+
+def endpoint_name(method, url):
+    """
+    Groups requests by endpoint: ids in the path are replaced with `{id}`,
+    e.g. `GET v1/media/{id}/captions`. URLs outside the API are grouped by
+    host.
+    """
+    parsed = urllib.parse.urlparse(url)
+    path = re.sub("/+", "/", parsed.path)
+    if not path.startswith("/api/public/"):
+        return f"{method.upper()} {parsed.hostname}"
+    segments = [
+        "{id}" if re.fullmatch(r"\d+|[0-9a-fA-F-]{16,}", segment) else segment
+        for segment in path[len("/api/public/") :].strip("/").split("/")
+    ]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+def format_summary(summary):
+    """
+    Formats the output of `Metrics.summary` as a text report.
+    """
+    lines = [
+        f"Requests: {summary['requests']}, retries: {summary['retries']}, "
+        f"token refreshes: {summary['token_refreshes']}",
+        f"Received: {_format_bytes(summary['bytes_in'])}, "
+        f"sent: {_format_bytes(summary['bytes_out'])}",
+        f"Sleeping before retries: {summary['backoff_seconds']:.2f}s, "
+        f"waiting for the rate limiter: {summary['rate_limit_wait_seconds']:.2f}s",
+        "Status codes: "
+        + (
+            ", ".join(
+                f"{code}: {count}" for code, count in summary["status_codes"].items()
+            )
+            or "-"
+        ),
+    ]
+    if summary["errors"]:
+        lines.append(
+            "Errors: "
+            + ", ".join(
+                f"{error}: {count}" for error, count in summary["errors"].items()
+            )
+        )
+    if summary.get("cache"):
+        lines.append(
+            "Cache: "
+            + ", ".join(f"{name}: {value}" for name, value in summary["cache"].items())
+        )
+    if summary["endpoints"]:
+        width = max(len(endpoint) for endpoint in summary["endpoints"])
+        lines.append("")
+        lines.append(
+            f"{'endpoint':{width}} {'count':>7} {'total [s]':>10} {'mean [ms]':>10} "
+            f"{'p50 [ms]':>9} {'p95 [ms]':>9} {'p99 [ms]':>9} {'max [ms]':>9}"
+        )
+        for endpoint, histogram in summary["endpoints"].items():
+            lines.append(
+                f"{endpoint:{width}} {histogram['count']:7} "
+                f"{histogram['total_seconds']:10.2f} "
+                f"{histogram['mean_seconds'] * 1000:10.1f} "
+                f"{histogram['p50_seconds'] * 1000:9.1f} "
+                f"{histogram['p95_seconds'] * 1000:9.1f} "
+                f"{histogram['p99_seconds'] * 1000:9.1f} "
+                f"{histogram['max_seconds'] * 1000:9.1f}"
+            )
+    return "\n".join(lines)
+
+
+def write_summary(summary, path):
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=4)
+
+
+def _format_bytes(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
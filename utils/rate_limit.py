@@ -0,0 +1,117 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, with bursts of up to
+    `burst` requests. Thread safe.
+
+    `reserve()` takes a token right away (the bucket can go into debt) and
+    returns how long the caller has to wait before using it, so waiting
+    callers are served in the order they arrived. It can take more tokens at
+    once, e.g. when the tokens are bytes.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens, wait = _take_token(
+                self.tokens, now - self.updated_at, self.rate, self.burst, amount
+            )
+            self.updated_at = now
+        return wait
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+
+class FileTokenBucket:
+    """
+    A `TokenBucket` whose state is kept in a file, so it's shared by all the
+    processes on the host that use the same file. The file is locked with
+    `flock` while the state is updated.
+    """
+
+    def __init__(self, path, rate, burst=None):
+        self.path = path
+        self.rate = rate
+        self.burst = burst or rate
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def reserve(self, amount=1):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.load(f)
+                except ValueError:
+                    state = {"tokens": self.burst, "updated_at": time.time()}
+                # wall clock time, monotonic clocks are not comparable between processes
+                now = time.time()
+                tokens, wait = _take_token(
+                    state["tokens"],
+                    max(0.0, now - state["updated_at"]),
+                    self.rate,
+                    self.burst,
+                    amount,
+                )
+                f.seek(0)
+                f.truncate()
+                json.dump({"tokens": tokens, "updated_at": now}, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+
+def _take_token(tokens, elapsed, rate, burst, amount=1):
+    tokens = min(burst, tokens + elapsed * rate) - amount
+    return tokens, max(0.0, -tokens / rate)
+
+
+def get_rate_limiter(client, cache_dir):
+    """
+    Returns the rate limiter configured by the `rate_limit` object of the
+    client's config, e.g. `{"requests_per_second": 10, "burst": 20}`, or None.
+
+    Clients of the same Studio instance share one limiter in the process. With
+    `"shared": true` it is also shared with other processes on the host,
+    through a file in `cache_dir`.
+    """
+    rate_limit = client.config.get("rate_limit")
+    if not rate_limit:
+        return None
+
+    instance = client.instance_name()
+    with _rate_limiters_lock:
+        if instance not in _rate_limiters:
+            rate = rate_limit["requests_per_second"]
+            burst = rate_limit.get("burst")
+            if rate_limit.get("shared", False):
+                _rate_limiters[instance] = FileTokenBucket(
+                    os.path.join(cache_dir, "rate_limit", f"{instance}.json"),
+                    rate,
+                    burst,
+                )
+            else:
+                _rate_limiters[instance] = TokenBucket(rate, burst)
+        return _rate_limiters[instance]
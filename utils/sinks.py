@@ -0,0 +1,293 @@
+import csv
+import json
+import os
+import sqlite3
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+FORMATS = ["csv", "jsonl", "sqlite", "parquet"]
+EXTENSIONS = {"csv": "csv", "jsonl": "jsonl", "sqlite": "sqlite3", "parquet": "parquet"}
+BATCH_SIZE = 1000
+
+# column types, values are converted to them by the typed formats
+STRING = "string"
+INTEGER = "integer"
+FLOAT = "float"
+JSON = "json"
+
+
+def open_sink(format, path, name, columns, resume_from=None):
+    """
+    Opens a sink writing rows of `columns` (a list of `(name, type)`) to
+    `path`. `name` is the table name of the SQLite format.
+
+    Without `resume_from` the output is created anew. Otherwise the existing
+    output is truncated to the position returned by `sync()` earlier, and the
+    new rows are added after it.
+    """
+    if format == "csv":
+        return CsvSink(path, columns, resume_from)
+    if format == "jsonl":
+        return JsonlSink(path, columns, resume_from)
+    if format == "sqlite":
+        return SqliteSink(path, name, columns, resume_from)
+    if format == "parquet":
+        return ParquetSink(path, columns, resume_from)
+    raise ValueError(f"Unknown output format {format}, use one of {FORMATS}")
+
+
+def output_path(basename, format):
+    return f"{basename}.{EXTENSIONS[format]}"
+
+
+class Sink:
+    """
+    Buffers rows and writes them in batches of `BATCH_SIZE`. Rows are
+    sequences of values in the order of the columns, as with `csv.writer`.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.buffer = []
+
+    def writerow(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= BATCH_SIZE:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self.buffer:
+            self._write(self.buffer)
+            self.buffer = []
+
+    def sync(self):
+        """
+        Writes the buffered rows durably and returns the position of the end
+        of the output, to be used as `resume_from`.
+        """
+        self.flush()
+        return self._sync()
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _typed_rows(self, rows):
+        return [
+            [convert_value(value, type) for value, (_, type) in zip(row, self.columns)]
+            for row in rows
+        ]
+
+    def _write(self, rows):
+        raise NotImplementedError
+
+    def _sync(self):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+
+class FileSink(Sink):
+    """
+    A sink writing lines to a text file, positions are offsets in the file.
+    """
+
+    def __init__(self, path, columns, resume_from):
+        super().__init__(columns)
+        if resume_from is None:
+            self.file = open(path, "w", encoding="utf-8", newline="")
+            self._write_header()
+        else:
+            self.file = open(path, "r+", encoding="utf-8", newline="")
+            if os.fstat(self.file.fileno()).st_size < resume_from:
+                self.file.close()
+                raise Exception(
+                    f"{path} is shorter than the position to resume from, it was changed since"
+                )
+            self.file.truncate(resume_from)
+            self.file.seek(resume_from)
+
+    def _write_header(self):
+        pass
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def _close(self):
+        self.file.close()
+
+
+class CsvSink(FileSink):
+    """
+    Writes the values as they are, except for JSON columns which are
+    serialized.
+    """
+
+    def __init__(self, path, columns, resume_from):
+        self.writer = None
+        super().__init__(path, columns, resume_from)
+        self.writer = csv.writer(self.file)
+
+    def _write_header(self):
+        csv.writer(self.file).writerow([name for name, _ in self.columns])
+
+    def _write(self, rows):
+        json_columns = [
+            index for index, (_, type) in enumerate(self.columns) if type == JSON
+        ]
+        if json_columns:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for index in json_columns:
+                    if row[index] is not None:
+                        row[index] = json.dumps(row[index])
+        self.writer.writerows(rows)
+
+
+class JsonlSink(FileSink):
+    """
+    Writes one JSON object per row, with typed values.
+    """
+
+    def _write(self, rows):
+        names = [name for name, _ in self.columns]
+        self.file.write(
+            "".join(
+                json.dumps(dict(zip(names, row))) + "\n"
+                for row in self._typed_rows(rows)
+            )
+        )
+
+
+class SqliteSink(Sink):
+    """
+    Inserts the rows into the `name` table, which is created with the column
+    types if needed. Positions are rowids.
+    """
+
+    SQL_TYPES = {STRING: "TEXT", INTEGER: "INTEGER", FLOAT: "REAL", JSON: "TEXT"}
+
+    def __init__(self, path, name, columns, resume_from):
+        super().__init__(columns)
+        self.connection = sqlite3.connect(path)
+        self.table = _quote_identifier(name)
+        with self.connection:
+            if resume_from is None:
+                self.connection.execute(f"DROP TABLE IF EXISTS {self.table}")
+            definitions = ", ".join(
+                f"{_quote_identifier(column)} {self.SQL_TYPES[type]}"
+                for column, type in self.columns
+            )
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ({definitions})"
+            )
+            if resume_from is not None:
+                self.connection.execute(
+                    f"DELETE FROM {self.table} WHERE rowid > ?", (resume_from,)
+                )
+        placeholders = ", ".join("?" * len(self.columns))
+        self.insert = f"INSERT INTO {self.table} VALUES ({placeholders})"
+
+    def _write(self, rows):
+        rows = self._typed_rows(rows)
+        json_columns = [
+            index for index, (_, type) in enumerate(self.columns) if type == JSON
+        ]
+        for row in rows:
+            for index in json_columns:
+                if row[index] is not None:
+                    row[index] = json.dumps(row[index])
+        self.connection.executemany(self.insert, rows)
+
+    def _sync(self):
+        self.connection.commit()
+        return self.connection.execute(
+            f"SELECT COALESCE(MAX(rowid), 0) FROM {self.table}"
+        ).fetchone()[0]
+
+    def _close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class ParquetSink(Sink):
+    """
+    Writes every batch as a row group of a Parquet file, with typed columns.
+    JSON columns are stored as strings. Parquet files can't be appended to,
+    so the output can't be resumed.
+    """
+
+    def __init__(self, path, columns, resume_from):
+        if pyarrow is None:
+            raise Exception(
+                "The parquet format needs pyarrow, install it with `pip install pyarrow`"
+            )
+        if resume_from is not None:
+            raise ValueError("Parquet outputs can't be resumed")
+        super().__init__(columns)
+        arrow_types = {
+            STRING: pyarrow.string(),
+            INTEGER: pyarrow.int64(),
+            FLOAT: pyarrow.float64(),
+            JSON: pyarrow.string(),
+        }
+        self.schema = pyarrow.schema(
+            [(name, arrow_types[type]) for name, type in self.columns]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def _write(self, rows):
+        rows = self._typed_rows(rows)
+        values = {}
+        for index, (name, type) in enumerate(self.columns):
+            values[name] = [row[index] for row in rows]
+            if type == JSON:
+                values[name] = [
+                    None if value is None else json.dumps(value)
+                    for value in values[name]
+                ]
+        self.writer.write_table(pyarrow.table(values, schema=self.schema))
+
+    def _sync(self):
+        return None
+
+    def _close(self):
+        self.writer.close()
+
+
+def convert_value(value, type):
+    """
+    Converts a value (e.g. a string read from a CSV file) to the column type.
+    Empty numbers become None, empty strings stay empty.
+    """
+    if type == JSON or value is None:
+        return value
+    if type == STRING:
+        return str(value)
+    if value == "":
+        return None
+    if type == INTEGER:
+        return int(value)
+    return float(value)
+
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
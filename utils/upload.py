@@ -0,0 +1,121 @@
+import datetime
+import mmap
+import os
+import time
+import urllib.parse
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# presigned URLs expiring sooner than this are renewed before the upload starts
+URL_EXPIRY_MARGIN = 60
+
+
+class PresignedUrlExpired(Exception):
+    pass
+
+
+class UploadBody:
+    """
+    The content of a file as a request body, read through a read-only memory
+    map in chunks of `UPLOAD_CHUNK_SIZE`, so only the chunk being sent is
+    copied into memory. Iterating starts at the current position, and
+    `seek(0)` rewinds it for the next attempt.
+
+    `progress` is called after every chunk with the bytes sent in the current
+    attempt, the size of the file and the throughput of the attempt in bytes
+    per second. If `bandwidth_limiter` (a `TokenBucket` of bytes, which can be
+    shared by parallel uploads) is given, every chunk waits for its bytes.
+    """
+
+    def __init__(self, path, progress=None, bandwidth_limiter=None):
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        # empty files can't be mapped
+        self.map = (
+            mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.size
+            else b""
+        )
+        self.position = 0
+        self.progress = progress
+        self.bandwidth_limiter = bandwidth_limiter
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        start = time.monotonic()
+        offset = self.position
+        while self.position < self.size:
+            chunk = self.map[self.position : self.position + UPLOAD_CHUNK_SIZE]
+            if self.bandwidth_limiter:
+                time.sleep(self.bandwidth_limiter.reserve(len(chunk)))
+            self.position += len(chunk)
+            yield chunk
+            if self.progress:
+                sent = self.position - offset
+                elapsed = time.monotonic() - start
+                self.progress(
+                    self.position, self.size, sent / elapsed if elapsed else 0.0
+                )
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        self.position = position
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def upload_file(
+    public_api_client, presigned_url, path, progress=None, bandwidth_limiter=None
+):
+    """
+    PUTs the file to the presigned URL, with the retries of the client. Every
+    retry sends the file from the start again. Raises `PresignedUrlExpired`
+    if the URL expired (or is about to), a new one has to be requested then.
+    """
+    expires_at = presigned_url_expires_at(presigned_url)
+    if expires_at is not None and expires_at - URL_EXPIRY_MARGIN < time.time():
+        raise PresignedUrlExpired("The upload URL has expired")
+
+    with UploadBody(path, progress, bandwidth_limiter) as body:
+        # an empty iterable body would be sent chunked, which S3 doesn't accept
+        response = public_api_client.request_url(
+            "put", presigned_url, data=body if len(body) else b""
+        )
+    if is_expired_url_response(response):
+        raise PresignedUrlExpired(f"The upload URL has expired: {response.text}")
+    if response.status_code != 200:
+        raise Exception(f"Could not upload file: {response.text}")
+
+
+def presigned_url_expires_at(url):
+    """
+    Returns when an S3 presigned URL expires as a Unix timestamp, from its
+    `X-Amz-Date` and `X-Amz-Expires` parameters, or None for other URLs.
+    """
+    params = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    try:
+        signed_at = datetime.datetime.strptime(
+            params["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ"
+        ).replace(tzinfo=datetime.timezone.utc)
+        return signed_at.timestamp() + int(params["X-Amz-Expires"][0])
+    except (KeyError, ValueError):
+        return None
+
+
+def is_expired_url_response(response):
+    # S3 answers 403 "Request has expired", or 400 "ExpiredToken" when the
+    # credentials of the signature have expired
+    return response.status_code in [400, 403] and "expired" in response.text.lower()
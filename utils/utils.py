@@ -1,16 +1,45 @@
 import argparse
+import collections
+import email.utils
+import fcntl
+import hashlib
+import io
 import json
 import os
+import random
+import re
 import requests
+import tempfile
+import threading
 import time
 import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from http.client import HTTPConnection
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from utils.cache import ResponseCache
+from utils.metrics import Metrics, format_summary, write_summary
+from utils.rate_limit import get_rate_limiter
 
 
 DEFAULT_CONFIG_FILE = "config.json"
+CACHE_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", ".cache"))
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 300
+# access tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 60
+# requests of other methods (e.g. the POSTs refreshing the tokens or creating
+# media) are only retried after errors if they never reached the server
+IDEMPOTENT_METHODS = frozenset(["get", "head", "options", "put", "delete"])
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
 
 
-class PublicAPIClient:
+class BaseAPIClient:
     def __init__(self, config_file=DEFAULT_CONFIG_FILE):
         self.config_file = config_file
         self.config_path = os.path.realpath(
@@ -21,42 +50,74 @@ class PublicAPIClient:
         self.domain = self.config.get("domain", "instructuremedia.com")
         self.scheme = self.config.get("scheme", "https")
 
-    def request(self, method, url, params=None, data=None, version_prefix="v1/"):
-        response = request_with_retry(
-            method,
-            f"{self.scheme}://{self.subdomain}.{self.domain}/api/public/{version_prefix}{url}",
-            headers={
-                "Authorization": f"Bearer {self.config['access_token']}",
-            },
-            params=params,
-            data=data,
-        )
-        if response.status_code == 401:
-            self.refresh_tokens()
-            response = self.request(method, url, params=params, data=data)
-        return response
+    def instance_name(self):
+        """
+        Identifies the Studio instance in file names, e.g. `tw.instructuremedia.com`.
+        """
+        return re.sub(r"[^\w.-]", "_", f"{self.subdomain}.{self.domain}")
 
-    def refresh_tokens(self):
-        response = request_with_retry(
-            "post",
-            f"{self.scheme}://{self.subdomain}.{self.domain}/api/public/oauth/token",
-            data={
-                "client_id": self.config["client_id"],
-                "client_secret": self.config["client_secret"],
-                "refresh_token": self.config["refresh_token"],
-                "grant_type": "refresh_token",
-            },
-        )
-        if response.status_code != 200:
-            raise Exception(f"Could not refresh tokens: {response.text}")
+    def _api_url(self, url, version_prefix="v1/"):
+        return f"{self.scheme}://{self.subdomain}.{self.domain}/api/public/{version_prefix}{url}"
+
+    def _authorization_headers(self, access_token):
+        return {"Authorization": f"Bearer {access_token}"}
+
+    def _refresh_tokens_data(self):
+        return {
+            "client_id": self.config["client_id"],
+            "client_secret": self.config["client_secret"],
+            "refresh_token": self.config["refresh_token"],
+            "grant_type": "refresh_token",
+        }
+
+    def _update_tokens(self, tokens):
         self.config.update(
             {
-                "access_token": response.json()["access_token"],
-                "refresh_token": response.json()["refresh_token"],
+                "access_token": tokens["access_token"],
+                "refresh_token": tokens["refresh_token"],
             }
         )
+        if "expires_in" in tokens:
+            self.config["access_token_expires_at"] = time.time() + tokens["expires_in"]
+        else:
+            self.config.pop("access_token_expires_at", None)
         self._save_config()
 
+    def _token_expires_soon(self):
+        expires_at = self.config.get("access_token_expires_at")
+        return (
+            expires_at is not None and time.time() > expires_at - TOKEN_REFRESH_MARGIN
+        )
+
+    def _needs_refresh(self, stale_access_token):
+        """
+        Called with the config file locked: picks up tokens another process
+        has refreshed in the meantime, and returns whether `stale_access_token`
+        still has to be replaced.
+        """
+        with open(self.config_path, "rt") as f:
+            saved_config = json.load(f)
+        if saved_config.get("refresh_token") != self.config["refresh_token"]:
+            for key in ["access_token", "refresh_token", "access_token_expires_at"]:
+                if key in saved_config:
+                    self.config[key] = saved_config[key]
+        if stale_access_token is None:
+            return True
+        return self.config["access_token"] == stale_access_token
+
+    @contextmanager
+    def _config_file_lock(self):
+        """
+        Locks the config file between processes (through a separate lock
+        file, as the config file itself is replaced when it's saved).
+        """
+        with open(f"{self.config_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
     def _load_config(self):
         with open(self.config_path, "rt") as f:
             try:
@@ -78,24 +139,492 @@ class PublicAPIClient:
                 )
 
     def _save_config(self):
-        with open(self.config_path, "wt") as f:
-            json.dump(self.config, f, indent=4, sort_keys=True)
+        write_json_atomically(self.config_path, self.config, indent=4, sort_keys=True)
+
+
+class PublicAPIClient(BaseAPIClient):
+    def __init__(self, config_file=DEFAULT_CONFIG_FILE):
+        super().__init__(config_file)
+        self.session = create_session(
+            pool_connections=self.config.get(
+                "pool_connections", DEFAULT_POOL_CONNECTIONS
+            ),
+            pool_maxsize=self.config.get("pool_maxsize", DEFAULT_POOL_MAXSIZE),
+        )
+        self.retry_policy = RetryPolicy.from_config(self.config.get("retry", {}))
+        self.timeout = (
+            self.config.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+            self.config.get("read_timeout", DEFAULT_READ_TIMEOUT),
+        )
+        self.rate_limiter = get_rate_limiter(self, CACHE_DIR)
+        self.refresh_lock = threading.Lock()
+        self.response_cache = None
+        if "cache" in self.config:
+            self.response_cache = ResponseCache.from_config(
+                self.config["cache"],
+                os.path.join(CACHE_DIR, "responses", self.instance_name()),
+            )
+        self.metrics = Metrics()
 
+    def __enter__(self):
+        return self
 
-def request_with_retry(method, url, headers=None, params=None, data=None, retry=3):
-    response = getattr(requests, method)(url, headers=headers, params=params, data=data)
-    if response.status_code >= 500:
-        if retry > 0:
-            time.sleep(3)
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def stats(self):
+        """
+        Returns the metrics of the requests sent by the client, and the stats
+        of the response cache if it's enabled.
+        """
+        extra = {}
+        if self.response_cache:
+            extra["cache"] = self.response_cache.get_stats()
+        return self.metrics.summary(extra)
+
+    def request(
+        self,
+        method,
+        url,
+        params=None,
+        data=None,
+        version_prefix="v1/",
+        stream=False,
+        headers=None,
+    ):
+        if self.response_cache and method == "get" and not stream and not headers:
+            return self.response_cache.request(
+                url,
+                params,
+                lambda conditional_headers: self._request(
+                    method,
+                    url,
+                    params,
+                    data,
+                    version_prefix,
+                    stream,
+                    conditional_headers,
+                ),
+                version_prefix,
+            )
+        return self._request(method, url, params, data, version_prefix, stream, headers)
+
+    def _request(self, method, url, params, data, version_prefix, stream, headers):
+        access_token = self.config["access_token"]
+        if self._token_expires_soon():
+            self.refresh_tokens(stale_access_token=access_token)
+            access_token = self.config["access_token"]
+
+        response = request_with_retry(
+            method,
+            self._api_url(url, version_prefix),
+            headers={**(headers or {}), **self._authorization_headers(access_token)},
+            params=params,
+            data=data,
+            session=self.session,
+            stream=stream,
+            retry_policy=self.retry_policy,
+            timeout=self.timeout,
+            rate_limiter=self.rate_limiter,
+            metrics=self.metrics,
+        )
+        if response.status_code == 401:
+            response.close()
+            self.refresh_tokens(stale_access_token=access_token)
+            response = self._request(
+                method, url, params, data, version_prefix, stream, headers
+            )
+        return response
+
+    def paginate(
+        self,
+        url,
+        params=None,
+        page_param="page",
+        per_page_param="per_page",
+        items_key=None,
+    ):
+        """
+        Yields the items of a paginated list endpoint. The next page is
+        requested in the background while the items of the current one are
+        consumed. `items_key` is the list in the response holding the items,
+        by default the only list in it.
+        """
+        params = dict(params or {})
+        page = int(params.get(page_param) or 1)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_page = executor.submit(self._get_page, url, params, page_param, page)
+            while next_page:
+                body = next_page.result()
+                items = body[items_key or _find_items_key(body)]
+                next_page = None
+                if _has_next_page(body, items, params.get(per_page_param)):
+                    page += 1
+                    next_page = executor.submit(
+                        self._get_page, url, params, page_param, page
+                    )
+                yield from items
+
+    def _get_page(self, url, params, page_param, page):
+        response = self.request("get", url, params={**params, page_param: page})
+        if response.status_code != 200:
+            raise Exception(f"Could not get page {page} of {url}: {response.text}")
+        return response.json()
+
+    def request_url(self, method, url, headers=None, data=None, stream=False):
+        """
+        Requests a URL outside of the API, e.g. a presigned upload URL, with
+        the connections and retry settings of the client.
+        """
+        return request_with_retry(
+            method,
+            url,
+            headers=headers,
+            data=data,
+            session=self.session,
+            stream=stream,
+            retry_policy=self.retry_policy,
+            timeout=self.timeout,
+            metrics=self.metrics,
+        )
+
+    def refresh_tokens(self, stale_access_token=None):
+        """
+        Refreshes the tokens, one thread (and process) at a time. If
+        `stale_access_token` is given and another caller has already replaced
+        it while this one was waiting, their tokens are used instead.
+        """
+        with self.refresh_lock, self._config_file_lock():
+            if not self._needs_refresh(stale_access_token):
+                return
             response = request_with_retry(
-                method,
+                "post",
+                self._api_url("oauth/token", version_prefix=""),
+                data=self._refresh_tokens_data(),
+                session=self.session,
+                retry_policy=self.retry_policy,
+                timeout=self.timeout,
+                rate_limiter=self.rate_limiter,
+                metrics=self.metrics,
+            )
+            if response.status_code != 200:
+                raise Exception(f"Could not refresh tokens: {response.text}")
+            self._update_tokens(response.json())
+            self.metrics.record_refresh()
+
+
+def create_session(
+    pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE
+):
+    """
+    Returns a `requests.Session` that keeps connections alive between calls.
+
+    `pool_connections` is the number of hosts to keep pools for, `pool_maxsize`
+    is the number of connections kept per host. The pool blocks instead of
+    opening extra connections, so the session can be shared between threads.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+PAGE_PARAMETERS = ["page"]
+PER_PAGE_PARAMETERS = ["per_page", "page_size", "limit"]
+
+
+def find_paging_parameters(parameter_names):
+    """
+    Returns the names of the page and page size parameters of an endpoint,
+    based on the names of its parameters in the API schema, or None if the
+    endpoint is not paginated.
+    """
+    page_param = next(
+        (name for name in PAGE_PARAMETERS if name in parameter_names), None
+    )
+    if page_param is None:
+        return None
+    per_page_param = next(
+        (name for name in PER_PAGE_PARAMETERS if name in parameter_names), None
+    )
+    return page_param, per_page_param
+
+
+def _find_items_key(body):
+    list_keys = [key for key, value in body.items() if isinstance(value, list)]
+    if len(list_keys) != 1:
+        raise Exception(f"Could not find the list of items in {list(body.keys())}")
+    return list_keys[0]
+
+
+def _has_next_page(body, items, per_page):
+    # e.g. "meta": {"current_page": 1, "last_page": 3}
+    meta = body.get("meta") or {}
+    last_page = meta.get("last_page", meta.get("total_pages"))
+    if "current_page" in meta and last_page is not None:
+        return meta["current_page"] < last_page
+    if not items:
+        return False
+    if per_page:
+        return len(items) >= int(per_page)
+    return True
+
+
+class RetryPolicy:
+    """
+    Decides which responses and exceptions `request_with_retry` retries, and
+    how long it waits before the next attempt.
+
+    The wait grows exponentially with the attempts (`backoff_factor * 2 **
+    attempt`, capped at `backoff_max`) and a random part of it is used, so
+    parallel clients don't retry in lockstep. If the response has a
+    `Retry-After` header, that is used instead. No retry is started after
+    `deadline` seconds since the first attempt.
+    """
+
+    # the settings of the `retry` object of the config file
+    CONFIG_KEYS = [
+        "retries",
+        "backoff_factor",
+        "backoff_max",
+        "status_codes",
+        "respect_retry_after",
+        "deadline",
+    ]
+
+    def __init__(
+        self,
+        retries=3,
+        backoff_factor=1.0,
+        backoff_max=60.0,
+        status_codes=frozenset([429, *range(500, 600)]),
+        exceptions=(requests.ConnectionError, requests.Timeout),
+        respect_retry_after=True,
+        deadline=None,
+    ):
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.status_codes = frozenset(status_codes)
+        self.exceptions = tuple(exceptions)
+        self.respect_retry_after = respect_retry_after
+        self.deadline = deadline
+
+    @classmethod
+    def from_config(cls, retry_config, **settings):
+        """
+        Creates a policy from the `retry` object of the config file, e.g.
+        `{"retries": 5, "status_codes": [429, 503], "deadline": 600}`.
+        The retried exceptions can't be set there, JSON has no classes, but
+        they can be given in `settings` with the other arguments of the
+        policy that aren't configurable.
+        """
+        unknown = set(retry_config) - set(cls.CONFIG_KEYS)
+        if unknown:
+            raise Exception(
+                f"Unknown retry settings {sorted(unknown)}, use {cls.CONFIG_KEYS}"
+            )
+        return cls(**retry_config, **settings)
+
+    def backoff(self, attempt, response=None):
+        if response is not None and self.respect_retry_after:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_factor * 2**attempt)
+        )
+
+    def can_retry(self, attempt, delay, deadline):
+        if attempt >= self.retries:
+            return False
+        return deadline is None or time.monotonic() + delay < deadline
+
+    def start_deadline(self):
+        return time.monotonic() + self.deadline if self.deadline else None
+
+
+def parse_retry_after(value):
+    """
+    Returns the seconds to wait from a `Retry-After` header, which is either
+    a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def request_with_retry(
+    method,
+    url,
+    headers=None,
+    params=None,
+    data=None,
+    retry=3,
+    session=None,
+    stream=False,
+    retry_policy=None,
+    timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    rate_limiter=None,
+    metrics=None,
+):
+    """
+    Sends the request, and retries it according to `retry_policy` (by default
+    `retry` times on 429/5xx responses, connection errors and timeouts).
+    Requests with methods not in `IDEMPOTENT_METHODS` are only retried after
+    an error if they weren't sent, as the server may have handled them.
+    `timeout` is a `(connect, read)` tuple in seconds. Every attempt waits for
+    a token from `rate_limiter`, if there is one, and is recorded in `metrics`.
+    A seekable `data` (e.g. a file) is rewound before every retry.
+    """
+    retry_policy = retry_policy or RetryPolicy(retries=retry)
+    deadline = retry_policy.start_deadline()
+    body_position = data.tell() if hasattr(data, "seek") else None
+    attempt = 0
+    while True:
+        if attempt and body_position is not None:
+            data.seek(body_position)
+        if rate_limiter:
+            wait = rate_limiter.reserve()
+            time.sleep(wait)
+            if metrics:
+                metrics.record_rate_limit_wait(wait)
+        start = time.perf_counter()
+        try:
+            response = getattr(session or requests, method)(
                 url,
                 headers=headers,
                 params=params,
                 data=data,
-                retry=retry - 1,
+                stream=stream,
+                timeout=timeout,
             )
-    return response
+        except retry_policy.exceptions as e:
+            if metrics:
+                metrics.record_attempt(
+                    method, url, time.perf_counter() - start, error=type(e).__name__
+                )
+            delay = retry_policy.backoff(attempt)
+            if not retry_policy.can_retry(attempt, delay, deadline):
+                raise
+            if method.lower() not in IDEMPOTENT_METHODS and not request_not_sent(e):
+                raise
+        else:
+            if metrics:
+                metrics.record_attempt(
+                    method,
+                    url,
+                    time.perf_counter() - start,
+                    status_code=response.status_code,
+                    bytes_in=_response_size(response, stream),
+                    bytes_out=int(response.request.headers.get("Content-Length") or 0),
+                )
+            if response.status_code not in retry_policy.status_codes:
+                return response
+            delay = retry_policy.backoff(attempt, response)
+            if not retry_policy.can_retry(attempt, delay, deadline):
+                return response
+            response.close()
+        if metrics:
+            metrics.record_retry(delay)
+        time.sleep(delay)
+        attempt += 1
+
+
+def request_not_sent(exception):
+    """
+    Returns True if the request failed before it was sent: the connection
+    timed out or couldn't be established.
+    """
+    if isinstance(exception, requests.ConnectTimeout):
+        return True
+    # other connection errors wrap the urllib3 one, as the reason of its
+    # MaxRetryError when the connection failed
+    reason = getattr(exception.args[0], "reason", None) if exception.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _response_size(response, stream):
+    # streamed bodies are not read yet, their size is taken from the headers
+    if stream:
+        return int(response.headers.get("Content-Length") or 0)
+    return len(response.content)
+
+
+def stream_text(response):
+    """
+    Returns the body of a streamed response as a text file, decoded as UTF-8
+    while it's read. Newlines are kept as they are, for the `csv` module.
+    """
+    response.raw.decode_content = True
+    # TextIOWrapper reads until EOF, so urllib3 shouldn't close the raw stream
+    # when the body is exhausted
+    response.raw.auto_close = False
+    return io.TextIOWrapper(response.raw, encoding="utf-8", newline="")
+
+
+def file_sha256(file):
+    """
+    Returns the SHA-256 hash of a file, given by its path or the descriptor of
+    an open file, which is hashed from its current position. The file is read
+    in large chunks into one reused buffer. hashlib releases the GIL while
+    hashing, so files can be hashed in parallel.
+    """
+    checksum = hashlib.sha256()
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(file, "rb", buffering=0, closefd=not isinstance(file, int)) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            checksum.update(view[:size])
+    return checksum.hexdigest()
+
+
+def write_json_atomically(path, data, **kwargs):
+    """
+    Writes `data` into a temporary file next to `path` and renames it over
+    `path`, so readers never see a half written file.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}."
+    )
+    try:
+        with os.fdopen(fd, "wt") as f:
+            json.dump(data, f, **kwargs)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def imap_ordered(executor, fn, iterable, window):
+    """
+    Like `executor.map`, but only submits `window` calls ahead of the consumer,
+    so a slow consumer doesn't pile up finished results.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 
 def add_default_arguments(parser):
@@ -106,6 +635,34 @@ def add_default_arguments(parser):
         default=DEFAULT_CONFIG_FILE,
         help="name of the config file",
     )
+    parser.add_argument(
+        "--stats",
+        default=False,
+        action="store_true",
+        help="print the metrics of the API requests to stderr at the end",
+    )
+    parser.add_argument(
+        "--stats-json",
+        type=str,
+        help="write the metrics of the API requests to this file as JSON",
+    )
+
+
+@contextmanager
+def report_stats(public_api_client, args):
+    """
+    Prints and/or saves the metrics of the client when the block exits, as
+    asked by the `--stats` and `--stats-json` arguments.
+    """
+    try:
+        yield
+    finally:
+        if args.stats or args.stats_json:
+            summary = public_api_client.stats()
+            if args.stats:
+                sys.stderr.write(format_summary(summary) + "\n")
+            if args.stats_json:
+                write_summary(summary, args.stats_json)
 
 
 def get_commandline_arguments(additional_arguments=None):